@@ -27,8 +27,18 @@ a = Analysis(
         'attendance_app.printer_control',
         'attendance_app.drive_handler',
         'attendance_app.offline_storage',
+        'attendance_app.sqlite_manager',
+        'attendance_app.file_lock',
+        'attendance_app.sync_hub',
+        'attendance_app.sync_worker',
+        'attendance_app.attendance_journal',
+        'attendance_app.history_format',
+        'attendance_app.history_cache',
+        'attendance_app.history_partitions',
+        'attendance_app.retention',
         'attendance_app.notification_monitor',
         'attendance_app.student_data_manager',
+        'attendance_app.student_roster',
         'attendance_app.report_system',
         'attendance_app.report_system.data_analyzer',
         'attendance_app.report_system.excel_report_generator',
@@ -6,8 +6,14 @@ Direct launcher for PyInstaller - bypasses start_app.py checks
 import sys
 import os
 import logging
+import multiprocessing
 from pathlib import Path
 
+# Report worker processes of the frozen app re-run this executable; handle them here and exit
+# before the GUI is imported
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+
 # Fix logging for PyInstaller environment
 def setup_logging():
     """Configure logging for PyInstaller environment"""
@@ -2,7 +2,9 @@
 エントリポイント
 """
 
-from attendance_app.main import main
-
 if __name__ == "__main__":
+    # レポートのワーカープロセス（spawn）はこのファイルを __mp_main__ として読み込むため、
+    # GUI（Kivy・音声・フォント）はここで起動するときだけ読み込む
+    from attendance_app.main import main
+
     main()
\ No newline at end of file
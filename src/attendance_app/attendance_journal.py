@@ -0,0 +1,92 @@
+"""
+Legacy attendance history reader for Attendance Management System v3.4
+Attendance records are stored in SQLite (offline_storage). Earlier versions kept
+them in an append-only event journal (attendance_events.csv), and before that in
+attendance_history.csv; this module reads either one once to migrate an existing
+installation.
+"""
+
+import csv
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List
+
+from attendance_app.history_format import (
+    HISTORY_COLUMNS, HISTORY_FILE, LEGACY_COLUMN_ALIASES, TIMESTAMP_FIELDS, normalize_timestamp,
+)
+from attendance_app.path_manager import get_output_dir
+
+logger = logging.getLogger(__name__)
+
+# Column layout of the legacy event journal
+EVENT_COLUMNS = ["Event", "Row", "StudentID", "Name", "Field", "Value", "Recorded_At"]
+
+# Journal event that starts a record; every other event sets one column of it
+EVENT_ENTRY = "entry"
+
+JOURNAL_FILE = get_output_dir() / "attendance_events.csv"
+
+
+def fold_events(events: Iterable[Dict[str, str]]) -> Dict[int, List[str]]:
+    """Fold journal events into {row: values} in the legacy attendance_history.csv layout."""
+    rows: Dict[int, List[str]] = {}
+    for event in events:
+        try:
+            row = int(event["Row"])
+        except (TypeError, ValueError):
+            logger.warning(f"Skipping malformed journal event: {event}")
+            continue
+
+        field, value = event["Field"], event["Value"]
+        if field in TIMESTAMP_FIELDS:
+            value = normalize_timestamp(value)
+
+        if event["Event"] == EVENT_ENTRY:
+            rows[row] = [value, event["StudentID"], event["Name"], "", "", "", ""]
+        elif field not in HISTORY_COLUMNS:
+            logger.warning(f"Skipping journal event with unknown field: {event}")
+        elif row in rows:
+            rows[row][HISTORY_COLUMNS.index(field)] = value
+        else:
+            logger.warning(f"Journal event refers to unknown row {row}: {event}")
+    return rows
+
+
+def _read_events(journal_path: Path) -> Iterator[Dict[str, str]]:
+    with open(journal_path, 'r', newline='', encoding='utf-8-sig') as f:
+        yield from csv.DictReader(f)
+
+
+def _read_history_csv(history_path: Path) -> Dict[int, List[str]]:
+    """Read a legacy attendance_history.csv as {row: values}, accepting older headers."""
+    rows: Dict[int, List[str]] = {}
+    with open(history_path, 'r', newline='', encoding='utf-8-sig') as f:
+        for row_number, record in enumerate(csv.DictReader(f), start=2):
+            record = {LEGACY_COLUMN_ALIASES.get(k, k): (v or "") for k, v in record.items() if k}
+            for field in TIMESTAMP_FIELDS:
+                if record.get(field):
+                    record[field] = normalize_timestamp(record[field])
+            rows[row_number] = [record.get(column, "") for column in HISTORY_COLUMNS]
+    return rows
+
+
+def read_legacy_records(journal_path: Path = JOURNAL_FILE,
+                        history_path: Path = HISTORY_FILE) -> Dict[int, List[str]]:
+    """
+    Read the records written by earlier versions as {row: values}, keyed by their 1-based
+    row in attendance_history.csv (header is row 1). The event journal is used if it exists,
+    otherwise a legacy attendance_history.csv.
+    """
+    if Path(journal_path).exists():
+        records = fold_events(_read_events(Path(journal_path)))
+    elif Path(history_path).exists():
+        records = _read_history_csv(Path(history_path))
+    else:
+        return {}
+
+    # Blank lines (e.g. ",,,,,," left by spreadsheet editors) are not records
+    entry, student = HISTORY_COLUMNS.index("Entry_Time"), HISTORY_COLUMNS.index("StudentID")
+    complete = {row: values for row, values in records.items() if values[entry] and values[student]}
+    if len(complete) < len(records):
+        logger.warning(f"Skipping {len(records) - len(complete)} legacy rows without StudentID or Entry_Time")
+    return complete
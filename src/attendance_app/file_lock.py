@@ -0,0 +1,173 @@
+"""
+File locking and atomic file replacement for Attendance Management System v3.4
+Files shared between kiosk, report and sync threads, and between several app
+processes on one machine (attendance_history.csv, history partitions, the
+Sample_Data workbook, sync state), are updated under an exclusive lock on a
+sibling ".lock" file and written to a unique temporary file that is renamed
+over the target, so readers never see a torn file and no update is lost.
+Readers do not keep these files open (Windows cannot rename over an open file),
+and the rename is retried briefly while another program still has the target open.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Dict, Iterator, Optional
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for another thread or process to release a lock
+LOCK_TIMEOUT = 30.0
+
+# Poll interval while another process holds the lock
+_POLL_INTERVAL = 0.05
+
+# Seconds to keep retrying the final rename while the target is open elsewhere (Windows)
+REPLACE_TIMEOUT = 5.0
+
+# Read once at import: os.umask can only be queried by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+class FileLockTimeout(TimeoutError):
+    """Raised when a file lock cannot be acquired within the timeout."""
+    pass
+
+
+class _PathLock:
+    """Per-process state of one lock file: a reentrant thread lock plus the OS-level lock."""
+
+    def __init__(self, lock_path: Path):
+        self.lock_path = lock_path
+        self.thread_lock = threading.RLock()
+        self.handle: Optional[IO] = None
+        self.depth = 0
+
+
+_path_locks: Dict[str, _PathLock] = {}
+_path_locks_guard = threading.Lock()
+
+
+def _path_lock(path: Path) -> _PathLock:
+    lock_path = Path(path).resolve().with_name(Path(path).name + ".lock")
+    with _path_locks_guard:
+        state = _path_locks.get(str(lock_path))
+        if state is None:
+            state = _path_locks[str(lock_path)] = _PathLock(lock_path)
+        return state
+
+
+def _try_lock(handle: IO) -> bool:
+    try:
+        if os.name == "nt":
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(handle: IO) -> None:
+    if os.name == "nt":
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def file_lock(path: Path, timeout: float = LOCK_TIMEOUT) -> Iterator[None]:
+    """
+    Hold an exclusive lock on ``path`` against other threads and other processes.
+    The lock is reentrant within a thread; raises FileLockTimeout after ``timeout`` seconds.
+    """
+    state = _path_lock(path)
+    deadline = time.monotonic() + timeout
+    if not state.thread_lock.acquire(timeout=timeout):
+        raise FileLockTimeout(f"Timed out waiting for lock on {path}")
+    try:
+        if state.depth == 0:
+            state.lock_path.parent.mkdir(parents=True, exist_ok=True)
+            handle = open(state.lock_path, 'a+b')
+            while not _try_lock(handle):
+                if time.monotonic() >= deadline:
+                    handle.close()
+                    raise FileLockTimeout(f"Timed out waiting for lock on {path} (held by another process)")
+                time.sleep(_POLL_INTERVAL)
+            state.handle = handle
+        state.depth += 1
+        try:
+            yield
+        finally:
+            state.depth -= 1
+            if state.depth == 0:
+                handle, state.handle = state.handle, None
+                try:
+                    _unlock(handle)
+                finally:
+                    handle.close()
+    finally:
+        state.thread_lock.release()
+
+
+def _replace(source: Path, target: Path) -> None:
+    """os.replace, retried while Windows refuses it because the target is open (antivirus, Excel, a reader)."""
+    deadline = time.monotonic() + REPLACE_TIMEOUT
+    while True:
+        try:
+            os.replace(source, target)
+            return
+        except PermissionError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(_POLL_INTERVAL)
+
+
+@contextmanager
+def atomic_path(path: Path) -> Iterator[Path]:
+    """
+    Yield a unique temporary path next to ``path``; once the block finishes it is
+    flushed to disk and renamed over ``path``. On error the target is left untouched.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    tmp_path = Path(tmp_name)
+    try:
+        # mkstemp creates the file owner-only; give it the target's (or the default) permissions
+        if path.exists():
+            shutil.copymode(path, tmp_path)
+        else:
+            os.chmod(tmp_path, 0o666 & ~_UMASK)
+        yield tmp_path
+        with open(tmp_path, 'ab') as f:
+            os.fsync(f.fileno())
+        _replace(tmp_path, path)
+    except BaseException:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        raise
+
+
+@contextmanager
+def atomic_write(path: Path, mode: str = 'w', **open_kwargs) -> Iterator[IO]:
+    """Open a temporary file for writing that atomically replaces ``path`` when closed."""
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, mode, **open_kwargs) as f:
+            yield f
@@ -0,0 +1,141 @@
+"""
+Columnar sidecar cache of attendance history CSVs for Attendance Management System v3.4
+Each history CSV (attendance_history.csv or a monthly partition) is parsed once into typed numpy arrays (.npy) stored next to it:
+timestamps as int64 epoch nanoseconds, student IDs / names / answers as small
+integer codes into per-column dictionaries. Readers load the arrays instead of
+re-parsing the CSV; the cache is rebuilt whenever the CSV changes.
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from attendance_app.file_lock import atomic_write, file_lock
+from attendance_app.history_format import (
+    HISTORY_COLUMNS, HISTORY_FILE, LEGACY_TIMESTAMP_FORMATS, TIMESTAMP_FIELDS, TIMESTAMP_FORMAT,
+)
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+
+# Columns stored as dictionary-encoded integer codes (-1 = missing)
+CATEGORY_COLUMNS = ["StudentID", "Name", "Mood", "Sleep_Satisfaction", "Purpose"]
+
+
+def parse_datetime_column(values: pd.Series) -> pd.Series:
+    """
+    日時文字列の列をまとめてパースする。
+    既知のフォーマットを1つずつ列全体に適用し、まだ NaT のセルだけを次のフォーマットで埋める。
+    履歴は書き込み時に TIMESTAMP_FORMAT に正規化されるため、通常は最初のフォーマットで完了する。
+    """
+    values = values.astype(object).where(values.notna(), '').astype(str).str.strip()
+    result = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    remaining = values != ''
+
+    for fmt in [TIMESTAMP_FORMAT] + LEGACY_TIMESTAMP_FORMATS:
+        if not remaining.any():
+            return result
+        parsed = pd.to_datetime(values[remaining], format=fmt, errors='coerce')
+        parsed = parsed[parsed.notna()]
+        result.loc[parsed.index] = parsed
+        remaining.loc[parsed.index] = False
+
+    # フォーマットが合わない残りのセルだけ汎用パーサーで1件ずつ処理
+    if remaining.any():
+        result.loc[remaining] = values[remaining].apply(lambda v: pd.to_datetime(v, errors='coerce'))
+    return result
+
+
+def _array_name(column: str) -> str:
+    return f"{column.lower()}.npy"
+
+
+class HistoryColumnCache:
+    """Typed columnar cache stored in ``<csv name>.cache/`` next to the history CSV."""
+
+    def __init__(self, csv_path: Path = HISTORY_FILE):
+        self.csv_path = Path(csv_path)
+        self.cache_dir = self.csv_path.with_name(self.csv_path.name + ".cache")
+        self.meta_path = self.cache_dir / "meta.json"
+
+    def _source_signature(self) -> Optional[Dict[str, int]]:
+        try:
+            stat = self.csv_path.stat()
+        except FileNotFoundError:
+            return None
+        return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def is_fresh(self) -> bool:
+        """True if the cache was built from the current version of the CSV."""
+        meta = self._read_meta()
+        return (meta is not None and meta.get("version") == CACHE_VERSION
+                and meta.get("source") == self._source_signature())
+
+    def rebuild(self) -> dict:
+        """Parse the CSV once and write the typed column arrays."""
+        source = self._source_signature()
+        df = pd.read_csv(self.csv_path, dtype=str, encoding='utf-8-sig')
+        df = df.reindex(columns=HISTORY_COLUMNS)
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        arrays = {}
+        for column in TIMESTAMP_FIELDS:
+            arrays[column] = parse_datetime_column(df[column]).to_numpy(dtype='datetime64[ns]').view('int64')
+
+        categories = {}
+        for column in CATEGORY_COLUMNS:
+            categorical = pd.Categorical(df[column])
+            arrays[column] = np.asarray(categorical.codes)
+            categories[column] = [str(value) for value in categorical.categories]
+
+        # Arrays first, meta last: a reader only trusts arrays whose meta matches the CSV
+        for column, array in arrays.items():
+            with atomic_write(self.cache_dir / _array_name(column), 'wb') as f:
+                np.save(f, array)
+
+        meta = {"version": CACHE_VERSION, "source": source, "rows": len(df), "categories": categories}
+        with atomic_write(self.meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        logger.info(f"Rebuilt history column cache: {len(df)} rows in {self.cache_dir}")
+        return meta
+
+    def load(self) -> pd.DataFrame:
+        """
+        Return the history as a DataFrame with datetime64 timestamps and
+        categorical text columns, rebuilding the cache first if it is stale.
+        """
+        # Held across the array loads so another process cannot swap arrays and meta in between
+        with file_lock(self.meta_path):
+            meta = self._read_meta()
+            if not (meta is not None and meta.get("version") == CACHE_VERSION
+                    and meta.get("source") == self._source_signature()):
+                meta = self.rebuild()
+
+            # Read into memory rather than memory-mapped: a mapped file could not be replaced
+            # by the next rebuild on Windows while the returned frame is alive
+            columns = {}
+            for column in HISTORY_COLUMNS:
+                array = np.load(self.cache_dir / _array_name(column))
+                if column in TIMESTAMP_FIELDS:
+                    columns[column] = pd.Series(array.view('datetime64[ns]'))
+                else:
+                    columns[column] = pd.Series(pd.Categorical.from_codes(
+                        array, categories=meta["categories"][column]))
+        return pd.DataFrame(columns, columns=HISTORY_COLUMNS)
+
+
+def load_history_frame(csv_path: Path = HISTORY_FILE) -> pd.DataFrame:
+    """attendance_history.csv を型付きの DataFrame として読み込む（列キャッシュ経由）"""
+    return HistoryColumnCache(csv_path).load()
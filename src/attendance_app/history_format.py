@@ -0,0 +1,50 @@
+"""
+Attendance history layout for Attendance Management System v3.4
+Column layout, file location and timestamp formats of attendance_history.csv,
+shared by the attendance store, its exports (history CSV, month partitions,
+Excel sync, sync hub) and the report cache.
+"""
+
+from datetime import datetime
+
+from attendance_app.path_manager import get_output_dir
+
+# Column layout of attendance_history.csv (exported from the attendance store)
+HISTORY_COLUMNS = ["Entry_Time", "StudentID", "Name", "Mood", "Sleep_Satisfaction", "Purpose", "Exit_Time"]
+
+# Canonical timestamp format of the attendance store and attendance_history.csv
+TIMESTAMP_FORMAT = "%Y/%m/%d %H:%M:%S"
+
+# Formats found in older history files, accepted and normalized on write
+LEGACY_TIMESTAMP_FORMATS = [
+    "%Y/%m/%d %H:%M",
+    "%Y/%m/%d %H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+]
+
+TIMESTAMP_FIELDS = ("Entry_Time", "Exit_Time")
+
+# Older CSV headers that are still accepted when reading history files
+LEGACY_COLUMN_ALIASES = {
+    "EntryTime": "Entry_Time",
+    "StudentName": "Name",
+    "Sleep": "Sleep_Satisfaction",
+    "ExitTime": "Exit_Time",
+}
+
+HISTORY_FILE = get_output_dir() / "attendance_history.csv"
+
+
+def normalize_timestamp(value: str) -> str:
+    """Convert a timestamp string to TIMESTAMP_FORMAT; unparseable values are returned unchanged."""
+    value = (value or "").strip()
+    # Fast path: already canonical (YYYY/MM/DD HH:MM:SS)
+    if len(value) == 19 and value[4] == "/" and value[7] == "/" and value[13] == ":" and value[16] == ":":
+        return value
+    for fmt in [TIMESTAMP_FORMAT] + LEGACY_TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime(TIMESTAMP_FORMAT)
+        except ValueError:
+            continue
+    return value
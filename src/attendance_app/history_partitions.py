@@ -0,0 +1,241 @@
+"""
+Month-partitioned attendance history for Attendance Management System v3.4
+Attendance records are materialized into one CSV per month
+(output/history/YYYY-MM.csv) instead of a single unbounded attendance_history.csv.
+Partitions are kept up to date incrementally from the attendance store's revision
+high-water mark, so only the months touched by changed records are rewritten,
+and partitions older than a few months are gzipped.
+Records removed from the store by retention are archived to output/archive/YYYY-MM.csv.gz
+in the same format, and rebuilds start from the archive so no history is lost.
+"""
+
+import csv
+import gzip
+import json
+import logging
+import shutil
+from datetime import date, datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from attendance_app.file_lock import atomic_path, atomic_write, file_lock
+from attendance_app.history_format import HISTORY_COLUMNS, normalize_timestamp
+from attendance_app.offline_storage import OfflineStorage, offline_storage
+from attendance_app.path_manager import get_output_dir
+from attendance_app.settings import settings_manager
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DIR = get_output_dir() / "history"
+ARCHIVE_DIR = get_output_dir() / "archive"
+
+# Partition files keep the record ID so later updates (exit times) replace the right row
+PARTITION_COLUMNS = HISTORY_COLUMNS + ["RecordID"]
+
+# Partition for rows whose Entry_Time cannot be parsed
+UNKNOWN_MONTH = "unknown"
+
+MANIFEST_VERSION = 2
+
+
+def month_key(entry_time: str) -> str:
+    """Return the partition key ("YYYY-MM") for an Entry_Time value."""
+    value = normalize_timestamp(entry_time)
+    try:
+        parsed = datetime.strptime(value[:7], "%Y/%m")
+    except ValueError:
+        try:
+            parsed = datetime.fromisoformat(value.replace("/", "-"))
+        except ValueError:
+            return UNKNOWN_MONTH
+    return f"{parsed.year:04d}-{parsed.month:02d}"
+
+
+def _months_before(today: date, months: int) -> str:
+    """Return the partition key ``months`` months before today's month."""
+    index = today.year * 12 + today.month - 1 - months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def read_partition_file(path: Path) -> Dict[int, List[str]]:
+    """Read a partition or archive file as {record_id: values}."""
+    opener = gzip.open if path.suffix == ".gz" else open
+    rows: Dict[int, List[str]] = {}
+    with opener(path, 'rt', newline='', encoding='utf-8-sig') as f:
+        for record in csv.DictReader(f):
+            rows[int(record["RecordID"])] = [record.get(column) or "" for column in HISTORY_COLUMNS]
+    return rows
+
+
+def write_partition_file(directory: Path, month: str, rows: Dict[int, List[str]], compressed: bool) -> str:
+    """Write one month atomically and return its file name."""
+    name = f"{month}.csv.gz" if compressed else f"{month}.csv"
+    path = directory / name
+    opener = gzip.open if compressed else open
+    with atomic_path(path) as tmp_path, opener(tmp_path, 'wt', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(PARTITION_COLUMNS)
+        for row in sorted(rows):
+            writer.writerow(rows[row] + [row])
+
+    # Drop the other representation of the month and its column cache, if any
+    other = path.with_name(f"{month}.csv" if compressed else f"{month}.csv.gz")
+    for stale in (other, other.with_name(other.name + ".cache")):
+        if stale.is_dir():
+            shutil.rmtree(stale, ignore_errors=True)
+        elif stale.exists():
+            stale.unlink()
+    return name
+
+
+def archive_history_rows(rows: List[Tuple[int, int, List[str]]], directory: Path = ARCHIVE_DIR) -> None:
+    """Merge (record_id, revision, values) rows into the monthly archive files."""
+    by_month: Dict[str, Dict[int, List[str]]] = {}
+    for record_id, _, values in rows:
+        by_month.setdefault(month_key(values[0]), {})[record_id] = values
+
+    directory.mkdir(parents=True, exist_ok=True)
+    with file_lock(directory):
+        for month, changes in by_month.items():
+            path = directory / f"{month}.csv.gz"
+            archived = read_partition_file(path) if path.exists() else {}
+            archived.update(changes)
+            write_partition_file(directory, month, archived, compressed=True)
+    logger.info(f"Archived {len(rows)} attendance records to {directory}")
+
+
+def iter_archived_rows(directory: Path = ARCHIVE_DIR) -> Iterator[Tuple[int, List[str]]]:
+    """Yield (record_id, values) of every archived record."""
+    with file_lock(directory):
+        paths = sorted(directory.glob("*.csv.gz"))
+        months = [read_partition_file(path) for path in paths]
+    for rows in months:
+        yield from rows.items()
+
+
+class HistoryPartitions:
+    """Monthly CSV partitions materialized from the attendance store.
+
+    manifest.json records the store revision that has been applied and the
+    file name of each partition. Refreshes hold a lock on the manifest, so
+    kiosk, report and sync processes can share one history directory.
+    """
+
+    def __init__(self, storage: OfflineStorage = offline_storage, directory: Path = HISTORY_DIR,
+                 archive_directory: Optional[Path] = ARCHIVE_DIR):
+        self.storage = storage
+        self.directory = Path(directory)
+        self.archive_directory = Path(archive_directory) if archive_directory else None
+        self.manifest_path = self.directory / "manifest.json"
+
+    # --- manifest -------------------------------------------------------
+
+    def _load_manifest(self) -> Optional[dict]:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("database") != str(self.storage.db_path):
+            return None
+        return manifest
+
+    def _save_manifest(self, manifest: dict) -> None:
+        with atomic_write(self.manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+
+    # --- partition files --------------------------------------------------
+
+    def _read_partition(self, path: Path) -> Dict[int, List[str]]:
+        return read_partition_file(path)
+
+    def _write_partition(self, month: str, rows: Dict[int, List[str]], compressed: bool) -> str:
+        return write_partition_file(self.directory, month, rows, compressed)
+
+    # --- refresh ----------------------------------------------------------
+
+    def _rebuild(self) -> dict:
+        """Re-materialize every partition from the archive and all records."""
+        manifest = {"version": MANIFEST_VERSION, "database": str(self.storage.db_path),
+                    "revision": 0, "months": {}}
+
+        by_month: Dict[str, Dict[int, List[str]]] = {}
+        if self.archive_directory is not None and self.archive_directory.is_dir():
+            for record_id, values in iter_archived_rows(self.archive_directory):
+                by_month.setdefault(month_key(values[0]), {})[record_id] = values
+        for record_id, revision, values in self.storage.get_history_rows():
+            by_month.setdefault(month_key(values[0]), {})[record_id] = values
+            manifest["revision"] = max(manifest["revision"], revision)
+
+        # Months without records: their files and column caches (<name>.cache/)
+        for path in self.directory.glob("*.csv*"):
+            if path.name.split(".")[0] in by_month:
+                continue
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink()
+        for month, rows in by_month.items():
+            manifest["months"][month] = self._write_partition(month, rows, compressed=self._is_old(month))
+        logger.info(f"Rebuilt {len(by_month)} monthly history partitions in {self.directory}")
+        return manifest
+
+    def _apply_changes(self, manifest: dict) -> None:
+        """Rewrite only the months that contain records changed since the manifest's revision."""
+        touched: Dict[str, Dict[int, List[str]]] = {}
+        for record_id, revision, values in self.storage.get_history_rows(manifest["revision"]):
+            touched.setdefault(month_key(values[0]), {})[record_id] = values
+            manifest["revision"] = max(manifest["revision"], revision)
+
+        for month, changes in touched.items():
+            name = manifest["months"].get(month)
+            rows = self._read_partition(self.directory / name) if name else {}
+            rows.update(changes)
+            manifest["months"][month] = self._write_partition(
+                month, rows, compressed=bool(name and name.endswith(".gz")))
+        logger.debug(f"Updated history partitions: {sorted(touched)}")
+
+    @staticmethod
+    def _is_old(month: str) -> bool:
+        """True if the month is older than history_compress_after_months and should be gzipped."""
+        keep_months = settings_manager.settings.history_compress_after_months
+        if keep_months <= 0 or month == UNKNOWN_MONTH:
+            return False
+        return month < _months_before(date.today(), keep_months)
+
+    def _compress_old_partitions(self, manifest: dict) -> None:
+        """gzip partitions that have aged past history_compress_after_months."""
+        for month, name in list(manifest["months"].items()):
+            if self._is_old(month) and not name.endswith(".gz"):
+                rows = self._read_partition(self.directory / name)
+                manifest["months"][month] = self._write_partition(month, rows, compressed=True)
+                logger.info(f"Compressed history partition {month}")
+
+    def refresh(self) -> None:
+        """Bring the partitions up to date with the attendance store."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with file_lock(self.manifest_path):
+            manifest = self._load_manifest()
+            current_revision = self.storage.current_revision()
+            if manifest is not None and manifest["revision"] == current_revision:
+                return
+
+            if manifest is None or manifest["revision"] > current_revision:
+                manifest = self._rebuild()
+            else:
+                self._apply_changes(manifest)
+            self._compress_old_partitions(manifest)
+            self._save_manifest(manifest)
+
+    # --- readers ----------------------------------------------------------
+
+    def partition_path(self, year: int, month: int) -> Optional[Path]:
+        """Return the partition file for the given month, or None if it has no records."""
+        self.refresh()
+        manifest = self._load_manifest() or {"months": {}}
+        name = manifest["months"].get(f"{year:04d}-{month:02d}")
+        return self.directory / name if name else None
+
+
+# Global partition store
+history_partitions = HistoryPartitions()
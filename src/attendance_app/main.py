@@ -21,6 +21,7 @@ from kivy.core.text import LabelBase
 from kivy.properties import StringProperty
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
+from kivy.uix.floatlayout import FloatLayout
 from kivy.uix.label import Label
 from kivy.uix.popup import Popup
 from kivy.uix.screenmanager import FadeTransition, Screen, ScreenManager
@@ -29,10 +30,13 @@ from kivy.uix.textinput import TextInput
 from kivy.uix.togglebutton import ToggleButton
 
 from attendance_app.config import load_settings, save_settings, validate_configuration
-from attendance_app.spreadsheet import get_student_name, get_last_record, write_exit, append_entry, write_response
+from attendance_app.spreadsheet import get_student_name, get_last_record, write_exit, append_entry, write_response_async
 from attendance_app.main_printer import PrintScreen
 from attendance_app.report_screen import ReportScreen
 from attendance_app.student_registry_screen import StudentRegistryScreen
+from attendance_app.retention import RETENTION_INTERVAL, run_retention
+from attendance_app.sync_worker import create_sync_worker
+from attendance_app.offline_storage import offline_storage
 
 logger = logging.getLogger(__name__)
 
@@ -125,6 +129,79 @@ def show_error_popup(title, message):
     close_btn.bind(on_release=popup.dismiss)
     popup.open()
 
+# --- 回答の非同期保存 ---
+ANSWER_SAVE_RETRIES = 5  # 保存失敗時の再試行回数（1, 2, 4, 8, 16秒後）
+
+class SaveStatusIndicator(Label):
+    """保存の再試行中に画面右上へ出す小さな表示（ポップアップと違い操作を妨げない）"""
+
+    def __init__(self, **kwargs):
+        super().__init__(
+            text="",
+            font_name=FONT_NAME,
+            font_size="14sp",
+            color=(0.85, 0.45, 0.1, 1),  # 注意を引くオレンジ
+            size_hint=(None, None),
+            size=("320dp", "32dp"),
+            pos_hint={"right": 0.99, "top": 0.99},
+            opacity=0,
+            **kwargs
+        )
+        self._hide_event = None
+
+    def show_retrying(self, count):
+        """再試行中の回答数を表示する（0なら隠す。ただし表示中の失敗通知は時間まで残す）"""
+        if self._hide_event:
+            if not count:
+                return
+            self._hide_event.cancel()
+            self._hide_event = None
+        self.text = f"回答を保存しています…（再試行中 {count}件）"
+        self.opacity = 1 if count else 0
+
+    def show_failed(self):
+        """保存をあきらめたことを一定時間表示する"""
+        self.text = "回答の保存に失敗しました（ログを確認してください）"
+        self.opacity = 1
+        if self._hide_event:
+            self._hide_event.cancel()
+        self._hide_event = Clock.schedule_once(self._hide_failed, 10)
+
+    def _hide_failed(self, dt):
+        self._hide_event = None
+        self.opacity = 0
+
+class AnswerSaver:
+    """回答を書き込み完了を待たずに保存し、失敗した分はバックグラウンドで再試行する"""
+
+    def __init__(self, indicator):
+        self.indicator = indicator
+        self._retrying = set()
+
+    def save(self, record_id, col, value, attempt=0):
+        future = write_response_async(record_id, col, value)
+        # 完了通知は書き込みスレッドから来るので、結果の処理はUIスレッドで行う
+        future.add_done_callback(
+            lambda f: Clock.schedule_once(lambda dt: self._on_saved(f.result(), record_id, col, value, attempt), 0))
+
+    def _on_saved(self, ok, record_id, col, value, attempt):
+        key = (record_id, col)
+        if ok:
+            self._retrying.discard(key)
+            self.indicator.show_retrying(len(self._retrying))
+            return
+
+        if attempt >= ANSWER_SAVE_RETRIES:
+            logger.error(f"Giving up saving answer for record {record_id}, column {col}: '{value}'")
+            self._retrying.discard(key)
+            self.indicator.show_failed()
+            return
+
+        self._retrying.add(key)
+        self.indicator.show_retrying(len(self._retrying))
+        logger.warning(f"Retrying answer save for record {record_id}, column {col} (attempt {attempt + 1})")
+        Clock.schedule_once(lambda dt: self.save(record_id, col, value, attempt + 1), 2 ** attempt)
+
 class HelpPopup(Popup):
     def __init__(self, title, message, **kwargs):
         super().__init__(**kwargs)
@@ -494,8 +571,8 @@ class WaitScreen(Screen):
             # Step 2: 最後の記録を取得
             try:
                 logger.info(f"Getting last record for ID: {sid}")
-                last_row, last_exit = get_last_record(sid)
-                logger.info(f"Last record result: row={last_row}, exit={repr(last_exit)}")
+                last_record_id, last_exit = get_last_record(sid)
+                logger.info(f"Last record result: record={last_record_id}, exit={repr(last_exit)}")
             except Exception as e:
                 logger.error(f"Error getting last record: {e}")
                 Clock.schedule_once(lambda dt: show_error_popup("エラー", f"出席記録の取得に失敗しました: {e}"), 0)
@@ -503,11 +580,11 @@ class WaitScreen(Screen):
                 return
 
             # Step 3: 入室/退室処理
-            if last_row and not last_exit:
+            if last_record_id is not None and not last_exit:
                 # 退室処理
                 logger.info(f"Processing exit for student: {sid}")
                 try:
-                    if write_exit(last_row):
+                    if write_exit(last_record_id):
                         app.student_name = name
                         logger.info(f"Exit successful for student: {sid}")
                         Clock.schedule_once(lambda dt: setattr(self.manager, "current", "goodbye"), 0)
@@ -523,11 +600,11 @@ class WaitScreen(Screen):
                 # 入室処理
                 logger.info(f"Processing entry for student: {sid}")
                 try:
-                    row_idx = append_entry(sid, name)
-                    if row_idx is not None:
-                        app.current_record_row = row_idx
+                    record_id = append_entry(sid, name)
+                    if record_id is not None:
+                        app.current_record_id = record_id
                         app.student_name = name
-                        logger.info(f"Entry successful for student: {sid}, row: {row_idx}")
+                        logger.info(f"Entry successful for student: {sid}, record: {record_id}")
                         Clock.schedule_once(lambda dt: setattr(self.manager, "current", "greeting"), 0)
                     else:
                         logger.error(f"Entry processing failed for student: {sid}")
@@ -830,16 +907,9 @@ class QuestionScreen(Screen):
         app = App.get_running_app()
         col = {"q1": 4, "q2": 5, "q3": 6}[self.key]
         
-        try:
-            result = write_response(app.current_record_row, col, value)
-            
-            if result:
-                self.manager.current = self.next_screen
-            else:
-                show_error_popup("エラー", "スプレッドシートへの書き込みに失敗しました")
-                
-        except Exception as e:
-            show_error_popup("エラー", f"スプレッドシートへの書き込みに失敗しました: {e}")
+        # 書き込みの完了は待たずに次の画面へ進む（失敗時はAnswerSaverが再試行して表示する）
+        app.answer_saver.save(app.current_record_id, col, value)
+        self.manager.current = self.next_screen
 
 class WelcomeScreen(Screen):
     """入室後の最終画面"""
@@ -1232,7 +1302,50 @@ class AttendanceApp(App):
 
         sm.add_widget(WelcomeScreen(name="welcome"))
         sm.add_widget(GoodbyeScreen(name="goodbye"))
-        return sm
+
+        # 画面の上に保存状態の表示を重ねる
+        root = FloatLayout()
+        root.add_widget(sm)
+        indicator = SaveStatusIndicator()
+        root.add_widget(indicator)
+        self.answer_saver = AnswerSaver(indicator)
+        return root
+
+    def on_start(self):
+        # SYNC_TARGET / SYNC_HUB_URL が設定されていれば、未送信の記録をバックグラウンドで送る
+        # （送信先に届かない間はローカルに溜め、間隔を延ばしながら再試行する）
+        # 送信先の準備（共有フォルダのDBを開くなど）も別スレッドで行い、起動を止めない
+        self.sync_worker = None
+        self._sync_setup_stop = threading.Event()
+        threading.Thread(target=self._start_sync_worker, name="sync-setup", daemon=True).start()
+
+        # 保存期間（RETENTION_DAYS）を過ぎた記録をアーカイブして削除する
+        # 起動直後の処理を妨げないよう少し待ってから開始し、以後は1日ごとに実行する
+        Clock.schedule_once(self._schedule_retention, 60)
+
+    def _start_sync_worker(self):
+        """送信先を準備して同期を開始する。準備に失敗したら時間をおいて再試行する"""
+        retry_seconds = settings_manager.settings.sync_max_backoff_seconds
+        while not self._sync_setup_stop.is_set():
+            try:
+                worker = create_sync_worker()
+            except Exception as e:
+                logger.error(f"Could not set up background sync (retrying in {retry_seconds:.0f}s): {e}")
+                self._sync_setup_stop.wait(retry_seconds)
+                continue
+            if worker is not None:
+                worker.start()
+                self.sync_worker = worker
+            return
+
+    def _schedule_retention(self, dt):
+        threading.Thread(target=run_retention, name="retention", daemon=True).start()
+        Clock.schedule_once(self._schedule_retention, RETENTION_INTERVAL)
+
+    def on_stop(self):
+        self._sync_setup_stop.set()
+        if self.sync_worker:
+            self.sync_worker.stop()
 
 
 
@@ -1243,6 +1356,10 @@ def main() -> None:
     CLI エントリポイント.
     `python -m attendance_app` から呼ばれる。
     """
+    # 以前のバージョンの出席履歴（イベントジャーナル / attendance_history.csv）を
+    # 記録が書き込まれる前に一度だけデータベースへ移行する
+    offline_storage.import_legacy_history()
+
     # 既存の GUI 起動処理を呼び出す
     AttendanceApp().run()
 
@@ -1,245 +1,664 @@
 """
 Offline storage support for Attendance Management System v3.4
-SQLite-based local storage for attendance records when online sync fails.
+SQLite-based local storage for attendance records. This is the primary
+attendance store: kiosk scans are indexed point queries and single-row writes,
+and the legacy attendance_history.csv is exported from it on demand.
+The question answers (Mood, Sleep_Satisfaction, Purpose) are integer codes into
+small lookup tables; the responses JSON only holds extra, free-form answers.
 """
 
+import atexit
+import csv
 import sqlite3
 import json
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional, Tuple
+from concurrent.futures import Future
 from contextlib import contextmanager
 
 from attendance_app.settings import settings_manager
+from attendance_app.file_lock import atomic_write, file_lock
+from attendance_app.sqlite_manager import SQLiteConnectionManager
+from attendance_app.attendance_journal import JOURNAL_FILE, read_legacy_records
+from attendance_app.history_format import HISTORY_COLUMNS, HISTORY_FILE, TIMESTAMP_FORMAT
 
 logger = logging.getLogger(__name__)
 
+# attendance_history.csv column -> attendance_records column
+RECORD_COLUMNS = {
+    "Entry_Time": "entry_time",
+    "StudentID": "student_id",
+    "Name": "student_name",
+    "Exit_Time": "exit_time",
+}
+
+# attendance_history.csv answer column -> (attendance_records code column, lookup table, kiosk choices)
+# Choices are seeded in display order; other labels (e.g. from imported history) get the next code
+RESPONSE_CODES = {
+    "Mood": ("mood_id", "mood_labels", ("快晴", "晴れ", "くもり", "雨", "豪雨")),
+    "Sleep_Satisfaction": ("sleep_id", "sleep_labels", ("100％", "75％", "50％", "25％", "0％")),
+    "Purpose": ("purpose_id", "purpose_labels", ("来る", "学ぶ", "話す", "楽しむ", "整える")),
+}
+RESPONSE_FIELDS = tuple(RESPONSE_CODES)
+
+# Record columns with the answer labels resolved (aliased to their attendance_history.csv names)
+RECORD_SELECT = '''
+    SELECT r.*, mood.label AS Mood, sleep.label AS Sleep_Satisfaction, purpose.label AS Purpose
+    FROM attendance_records r
+    LEFT JOIN mood_labels mood ON mood.id = r.mood_id
+    LEFT JOIN sleep_labels sleep ON sleep.id = r.sleep_id
+    LEFT JOIN purpose_labels purpose ON purpose.id = r.purpose_id
+'''
+
+# Every insert/update stamps the row with the next revision, so readers can
+# pick up the changes made since a revision they have already processed.
+# Revisions come from a one-row counter that only goes up: deriving them from the
+# remaining rows would hand out numbers again after retention deletes the newest ones.
+REVISION_COUNTER_TABLE = "revision_counter"
+
+# One-off database facts (key -> value), e.g. that the legacy history has been migrated
+META_TABLE = "meta"
+LEGACY_HISTORY_MIGRATED = "legacy_history_migrated"
+# Hub revision up to which the records of the sync hub have been merged
+HUB_PULLED_REVISION = "hub_pulled_revision"
+
+
+def next_revision(conn: sqlite3.Connection) -> int:
+    """Allocate the next revision from the counter. Call from a write job."""
+    conn.execute(f'UPDATE {REVISION_COUNTER_TABLE} SET value = value + 1 WHERE id = 1')
+    return conn.execute(f'SELECT value FROM {REVISION_COUNTER_TABLE} WHERE id = 1').fetchone()[0]
+
+
+def history_values(row: sqlite3.Row) -> List[str]:
+    """Convert a RECORD_SELECT row to a row in the legacy attendance_history.csv layout."""
+    return [row['entry_time'], row['student_id'], row['student_name'],
+            *(row[field] or "" for field in RESPONSE_FIELDS),
+            row['exit_time'] or ""]
+
+
+def record_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    """Convert a RECORD_SELECT row to a dict with all answers in 'responses' (None if there are none)."""
+    record = {key: row[key] for key in row.keys() if key not in RESPONSE_FIELDS}
+    # Only extra answers are JSON; records without any skip decoding
+    responses = json.loads(record['responses']) if record['responses'] else {}
+    responses.update((field, row[field]) for field in RESPONSE_FIELDS if row[field])
+    record['responses'] = responses or None
+    return record
+
+
+def split_responses(responses: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Split answers into (coded answers, extras stored as JSON)."""
+    coded, extras = {}, {}
+    for field, value in (responses or {}).items():
+        (coded if field in RESPONSE_CODES else extras)[field] = value
+    return coded, extras
+
+
+def response_code(conn: sqlite3.Connection, field: str, label: Any) -> Optional[int]:
+    """Code of an answer label (None for no answer), adding labels not seen before. Call from a write job."""
+    if label is None or label == "":
+        return None
+    _, table, _ = RESPONSE_CODES[field]
+    conn.execute(f'INSERT OR IGNORE INTO {table} (label) VALUES (?)', (str(label),))
+    return conn.execute(f'SELECT id FROM {table} WHERE label = ?', (str(label),)).fetchone()[0]
+
+
+def insert_history_records(conn: sqlite3.Connection, records: Dict[int, List[str]]) -> None:
+    """Insert records in the attendance_history.csv layout keyed by CSV row (ID row - 1). Call from a write job."""
+    now = datetime.now().isoformat()
+    rows = [(row, dict(zip(HISTORY_COLUMNS, records[row]))) for row in sorted(records)]
+    
+    # Imported records take the next revisions of the counter, in CSV order
+    base = conn.execute(f'SELECT value FROM {REVISION_COUNTER_TABLE} WHERE id = 1').fetchone()[0]
+    conn.execute(f'UPDATE {REVISION_COUNTER_TABLE} SET value = ? WHERE id = 1', (base + len(rows),))
+    
+    # Resolve each distinct answer label once
+    codes = {field: {} for field in RESPONSE_FIELDS}
+    for _, values in rows:
+        for field in RESPONSE_FIELDS:
+            label = values[field]
+            if label and label not in codes[field]:
+                codes[field][label] = response_code(conn, field, label)
+                
+    conn.executemany('''
+        INSERT INTO attendance_records
+        (id, student_id, student_name, entry_time, exit_time, mood_id, sleep_id, purpose_id,
+         created_at, updated_at, revision)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(row - 1, values["StudentID"], values["Name"], values["Entry_Time"], values["Exit_Time"] or None,
+           *(codes[field].get(values[field]) for field in RESPONSE_FIELDS), now, now, revision)
+          for revision, (row, values) in enumerate(rows, start=base + 1)])
+
+
 class OfflineStorage:
     """SQLite-based offline storage for attendance records."""
     
     def __init__(self, db_path: Optional[Path] = None):
         if db_path is None:
-            db_path = settings_manager.base_dir / "attendance_offline.db"
+            db_path = settings_manager.get_database_path()
         
         self.db_path = db_path
+        # Long-lived per-thread connections for reads, one group-commit writer thread for writes
+        settings = settings_manager.settings
+        self._db = SQLiteConnectionManager(
+            db_path,
+            batch_interval=settings.write_batch_interval_ms / 1000,
+            batch_size=settings.write_batch_max_events,
+            queue_size=settings.write_queue_size,
+        )
         self.init_database()
+        # Commit writes that are still queued when the app exits
+        atexit.register(self.close)
     
     def init_database(self):
         """Initialize the SQLite database with required tables."""
-        try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Attendance records table
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS attendance_records (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        student_id TEXT NOT NULL,
-                        student_name TEXT NOT NULL,
-                        entry_time TEXT NOT NULL,
-                        exit_time TEXT,
-                        responses TEXT,
-                        synced BOOLEAN DEFAULT FALSE,
-                        created_at TEXT NOT NULL,
-                        updated_at TEXT NOT NULL
+        def create_schema(conn):
+            cursor = conn.cursor()
+            
+            # Attendance records table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS attendance_records (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    student_id TEXT NOT NULL,
+                    student_name TEXT NOT NULL,
+                    entry_time TEXT NOT NULL,
+                    exit_time TEXT,
+                    mood_id INTEGER REFERENCES mood_labels (id),
+                    sleep_id INTEGER REFERENCES sleep_labels (id),
+                    purpose_id INTEGER REFERENCES purpose_labels (id),
+                    responses TEXT,
+                    synced BOOLEAN DEFAULT FALSE,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    revision INTEGER NOT NULL DEFAULT 0,
+                    origin_kiosk TEXT,
+                    origin_id INTEGER
+                )
+            ''')
+            
+            # Answer lookup tables, seeded with the kiosk choices
+            for column, table, choices in RESPONSE_CODES.values():
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        id INTEGER PRIMARY KEY,
+                        label TEXT NOT NULL UNIQUE
                     )
                 ''')
-                
-                # Sync log table
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS sync_log (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        timestamp TEXT NOT NULL,
-                        action TEXT NOT NULL,
-                        status TEXT NOT NULL,
-                        message TEXT,
-                        record_count INTEGER
-                    )
+                cursor.executemany(f'INSERT OR IGNORE INTO {table} (label) VALUES (?)',
+                                   [(choice,) for choice in choices])
+                                   
+            # Databases created before the revision column existed
+            columns = [row['name'] for row in cursor.execute('PRAGMA table_info(attendance_records)')]
+            if 'revision' not in columns:
+                cursor.execute('ALTER TABLE attendance_records ADD COLUMN revision INTEGER NOT NULL DEFAULT 0')
+                
+            # Records of other kiosks, merged from the sync hub, keep their (kiosk, record ID) there
+            if 'origin_kiosk' not in columns:
+                cursor.execute('ALTER TABLE attendance_records ADD COLUMN origin_kiosk TEXT')
+                cursor.execute('ALTER TABLE attendance_records ADD COLUMN origin_id INTEGER')
+                
+            # Databases that kept every answer in the responses JSON: move them to code columns
+            if 'mood_id' not in columns:
+                for field, (column, table, _) in RESPONSE_CODES.items():
+                    cursor.execute(f'ALTER TABLE attendance_records ADD COLUMN {column} INTEGER REFERENCES {table} (id)')
+                    answer = f"CAST(json_extract(responses, '$.{field}') AS TEXT)"
+                    cursor.execute(f'''
+                        INSERT OR IGNORE INTO {table} (label)
+                        SELECT DISTINCT {answer} FROM attendance_records WHERE {answer} <> ''
+                    ''')
+                    cursor.execute(f'''
+                        UPDATE attendance_records
+                        SET {column} = (SELECT id FROM {table} WHERE label = {answer})
+                        WHERE {answer} <> ''
+                    ''')
+                paths = ', '.join(f"'$.{field}'" for field in RESPONSE_FIELDS)
+                cursor.execute(f'''
+                    UPDATE attendance_records
+                    SET responses = NULLIF(json_remove(responses, {paths}), '{{}}')
+                    WHERE responses IS NOT NULL
                 ''')
                 
-                conn.commit()
-                logger.info(f"Offline database initialized: {self.db_path}")
-                
+            # Revision counter, seeded from the records of databases created before it existed
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {REVISION_COUNTER_TABLE} (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    value INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute(f'''
+                INSERT OR IGNORE INTO {REVISION_COUNTER_TABLE} (id, value)
+                SELECT 1, COALESCE(MAX(revision), 0) FROM attendance_records
+            ''')
+            # Rows written before revisions existed (revision 0) get one after the counter,
+            # so readers that start from revision 0 pick them up
+            cursor.execute(f'''
+                UPDATE attendance_records
+                SET revision = (SELECT value FROM {REVISION_COUNTER_TABLE} WHERE id = 1) + id
+                WHERE revision = 0
+            ''')
+            cursor.execute(f'''
+                UPDATE {REVISION_COUNTER_TABLE}
+                SET value = MAX(value, (SELECT COALESCE(MAX(revision), 0) FROM attendance_records))
+                WHERE id = 1
+            ''')
+                
+            # Per-student lookups (including the open session: latest entry) and change tracking
+            cursor.execute('DROP INDEX IF EXISTS idx_attendance_open')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_attendance_student_entry
+                ON attendance_records (student_id, entry_time)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_attendance_unsynced
+                ON attendance_records (entry_time) WHERE synced = FALSE
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_attendance_revision
+                ON attendance_records (revision)
+            ''')
+            cursor.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_origin
+                ON attendance_records (origin_kiosk, origin_id) WHERE origin_kiosk IS NOT NULL
+            ''')
+            # Retention scans synced records by age
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_attendance_synced_entry
+                ON attendance_records (entry_time) WHERE synced = TRUE
+            ''')
+            
+            # Sync log table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sync_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT NOT NULL,
+                    action TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    message TEXT,
+                    record_count INTEGER,
+                    duration_ms REAL,
+                    records_per_second REAL
+                )
+            ''')
+            
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {META_TABLE} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            ''')
+            
+            # Sync logs created before latency/throughput were recorded
+            columns = [row['name'] for row in cursor.execute('PRAGMA table_info(sync_log)')]
+            for column in ('duration_ms', 'records_per_second'):
+                if column not in columns:
+                    cursor.execute(f'ALTER TABLE sync_log ADD COLUMN {column} REAL')
+            
+        try:
+            self._db.write(create_schema)
+            logger.info(f"Offline database initialized: {self.db_path}")
+            
         except Exception as e:
             logger.error(f"Failed to initialize offline database: {e}")
             raise
     
     @contextmanager
     def get_connection(self):
-        """Get database connection with proper error handling."""
-        conn = None
+        """Get this thread's database connection for reads, with proper error handling."""
+        conn = self._db.connection()
         try:
-            conn = sqlite3.connect(str(self.db_path))
-            conn.row_factory = sqlite3.Row  # Enable dict-like row access
             yield conn
         except Exception as e:
-            if conn:
+            if conn.in_transaction:
                 conn.rollback()
             logger.error(f"Database error: {e}")
             raise
-        finally:
-            if conn:
-                conn.close()
+    
+    def close(self):
+        """Commit queued writes and stop the writer thread."""
+        self._db.close()
     
     def save_attendance_record(self, student_id: str, student_name: str, 
                              entry_time: str, responses: Dict[str, Any] = None) -> int:
         """Save an attendance record to offline storage."""
+        coded, extras = split_responses(responses)
+        
+        def insert(conn):
+            now = datetime.now().isoformat()
+            codes = [response_code(conn, field, coded.get(field)) for field in RESPONSE_FIELDS]
+            
+            cursor = conn.execute('''
+                INSERT INTO attendance_records
+                (student_id, student_name, entry_time, mood_id, sleep_id, purpose_id, responses,
+                 created_at, updated_at, revision)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (student_id, student_name, entry_time, *codes, json.dumps(extras) if extras else None, now, now,
+                  next_revision(conn)))
+            return cursor.lastrowid
+            
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                now = datetime.now().isoformat()
-                responses_json = json.dumps(responses) if responses else None
-                
-                cursor.execute('''
-                    INSERT INTO attendance_records 
-                    (student_id, student_name, entry_time, responses, created_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (student_id, student_name, entry_time, responses_json, now, now))
-                
-                record_id = cursor.lastrowid
-                conn.commit()
-                
-                logger.info(f"Saved offline attendance record: {record_id} for {student_name}")
-                return record_id
-                
+            record_id = self._db.write(insert)
+            logger.info(f"Saved offline attendance record: {record_id} for {student_name}")
+            return record_id
+            
         except Exception as e:
             logger.error(f"Failed to save offline attendance record: {e}")
             raise
     
     def update_exit_time(self, student_id: str, exit_time: str) -> bool:
         """Update exit time for the most recent unfinished record."""
+        def update(conn):
+            # Find the most recent record without exit time for this student
+            row = conn.execute('''
+                SELECT id FROM attendance_records
+                WHERE student_id = ? AND exit_time IS NULL
+                ORDER BY entry_time DESC LIMIT 1
+            ''', (student_id,)).fetchone()
+            if not row:
+                return None
+                
+            # Update the exit time in the same transaction
+            now = datetime.now().isoformat()
+            conn.execute('''
+                UPDATE attendance_records
+                SET exit_time = ?, updated_at = ?, synced = FALSE, revision = ?
+                WHERE id = ?
+            ''', (exit_time, now, next_revision(conn), row['id']))
+            return row['id']
+            
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Find the most recent record without exit time for this student
-                cursor.execute('''
-                    SELECT id FROM attendance_records 
-                    WHERE student_id = ? AND exit_time IS NULL 
-                    ORDER BY entry_time DESC LIMIT 1
-                ''', (student_id,))
-                
-                row = cursor.fetchone()
-                if not row:
-                    logger.warning(f"No unfinished record found for student {student_id}")
-                    return False
-                
-                # Update the exit time
-                now = datetime.now().isoformat()
-                cursor.execute('''
-                    UPDATE attendance_records 
-                    SET exit_time = ?, updated_at = ?
-                    WHERE id = ?
-                ''', (exit_time, now, row['id']))
-                
-                conn.commit()
-                logger.info(f"Updated exit time for offline record {row['id']}")
-                return True
-                
+            record_id = self._db.write(update)
+            if record_id is None:
+                logger.warning(f"No unfinished record found for student {student_id}")
+                return False
+            logger.info(f"Updated exit time for offline record {record_id}")
+            return True
+            
         except Exception as e:
             logger.error(f"Failed to update exit time: {e}")
             return False
     
     def update_responses(self, student_id: str, responses: Dict[str, Any]) -> bool:
         """Update responses for the most recent record."""
+        coded, extras = split_responses(responses)
+        
+        def update(conn):
+            # Find the most recent record for this student
+            row = conn.execute('''
+                SELECT id FROM attendance_records
+                WHERE student_id = ?
+                ORDER BY entry_time DESC LIMIT 1
+            ''', (student_id,)).fetchone()
+            if not row:
+                return None
+                
+            # Answers are set as codes; extras are merged into the JSON by SQLite
+            assignments = [f"{RESPONSE_CODES[field][0]} = ?" for field in coded]
+            params = [response_code(conn, field, value) for field, value in coded.items()]
+            if extras:
+                assignments.append("responses = json_patch(COALESCE(responses, '{}'), ?)")
+                params.append(json.dumps(extras))
+                
+            # Update the record
+            assignments += ["updated_at = ?", "synced = FALSE", "revision = ?"]
+            conn.execute(f'''
+                UPDATE attendance_records
+                SET {', '.join(assignments)}
+                WHERE id = ?
+            ''', params + [datetime.now().isoformat(), next_revision(conn), row['id']])
+            return row['id']
+            
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Find the most recent record for this student
-                cursor.execute('''
-                    SELECT id, responses FROM attendance_records 
-                    WHERE student_id = ? 
-                    ORDER BY entry_time DESC LIMIT 1
-                ''', (student_id,))
-                
-                row = cursor.fetchone()
-                if not row:
-                    logger.warning(f"No record found for student {student_id}")
-                    return False
-                
-                # Merge responses
-                existing_responses = json.loads(row['responses']) if row['responses'] else {}
-                existing_responses.update(responses)
-                
-                # Update the record
-                now = datetime.now().isoformat()
-                cursor.execute('''
-                    UPDATE attendance_records 
-                    SET responses = ?, updated_at = ?
-                    WHERE id = ?
-                ''', (json.dumps(existing_responses), now, row['id']))
-                
-                conn.commit()
-                logger.info(f"Updated responses for offline record {row['id']}")
-                return True
-                
+            record_id = self._db.write(update)
+            if record_id is None:
+                logger.warning(f"No record found for student {student_id}")
+                return False
+            logger.info(f"Updated responses for offline record {record_id}")
+            return True
+            
         except Exception as e:
             logger.error(f"Failed to update responses: {e}")
             return False
     
-    def get_unsynced_records(self) -> List[Dict[str, Any]]:
-        """Get all unsynced records for cloud synchronization."""
+    def get_open_session(self, student_id: str) -> Optional[Tuple[int, str]]:
+        """Return (record_id, entry_time) if the student's latest record has no exit time."""
+        with self.get_connection() as conn:
+            row = conn.execute('''
+                SELECT id, entry_time, exit_time FROM attendance_records
+                WHERE student_id = ?
+                ORDER BY entry_time DESC, id DESC LIMIT 1
+            ''', (student_id,)).fetchone()
+        if row is None or row['exit_time']:
+            return None
+        return row['id'], row['entry_time']
+    
+    def submit_record_field(self, record_id: int, field: str, value: str) -> "Future[bool]":
+        """
+        Queue setting one attendance_history.csv column (Exit_Time, Mood, ...) of a record by its ID.
+        The future resolves to False if there is no such record, once the write is committed.
+        """
+        if field in RECORD_COLUMNS:
+            column = RECORD_COLUMNS[field]
+            resolve = lambda conn: value
+        elif field in RESPONSE_CODES:
+            # Answers are stored as the code of their label
+            column = RESPONSE_CODES[field][0]
+            resolve = lambda conn: response_code(conn, field, value)
+        else:
+            raise ValueError(f"Unknown attendance field: {field}")
+            
+        sql = f'''
+            UPDATE attendance_records
+            SET {column} = ?, updated_at = ?, synced = FALSE, revision = ?
+            WHERE id = ?
+        '''
+        
+        def write(conn):
+            # Checked first so that a missing record adds no answer label and uses no revision
+            # (the writer holds the write lock, so the record cannot go away in between)
+            if conn.execute('SELECT 1 FROM attendance_records WHERE id = ?', (record_id,)).fetchone() is None:
+                return False
+            conn.execute(sql, (resolve(conn), datetime.now().isoformat(), next_revision(conn), record_id))
+            return True
+        
+        return self._db.submit(write)
+    
+    def get_history_rows(self, since_revision: int = 0) -> List[Tuple[int, int, List[str]]]:
+        """
+        Get (record_id, revision, values) of records changed after since_revision, in
+        record order, with values in the attendance_history.csv layout.
+        Database errors are raised so that callers never mistake them for "no records".
+        ("+r.id" keeps the planner on the revision index instead of a full rowid-order scan.)
+        """
+        with self.get_connection() as conn:
+            rows = conn.execute(f'''
+                {RECORD_SELECT}
+                WHERE r.revision > ?
+                ORDER BY +r.id
+            ''', (since_revision,)).fetchall()
+        return [(row['id'], row['revision'], history_values(row)) for row in rows]
+    
+    def current_revision(self) -> int:
+        """Get the revision of the latest change to attendance_records (never decreases, even after deletes)."""
+        with self.get_connection() as conn:
+            return conn.execute(f'SELECT value FROM {REVISION_COUNTER_TABLE} WHERE id = 1').fetchone()[0]
+    
+    def count_records(self) -> int:
+        """Get the number of attendance records."""
+        with self.get_connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM attendance_records').fetchone()[0]
+    
+    def import_history_records(self, records: Dict[int, List[str]]) -> int:
+        """
+        Bulk-load records in the attendance_history.csv layout keyed by their 1-based CSV row.
+        Record IDs are row - 1, so imported records keep their CSV order.
+        """
+        self._db.write(lambda conn: insert_history_records(conn, records))
+        logger.info(f"Imported {len(records)} attendance records into {self.db_path}")
+        return len(records)
+    
+    def import_legacy_history(self, journal_path: Path = JOURNAL_FILE, history_path: Path = HISTORY_FILE) -> int:
+        """
+        Move the attendance event journal / attendance_history.csv of earlier versions into an
+        empty database, once. Called at app start, before any record is written.
+        The migration is recorded in the meta table, so a database emptied later (by retention)
+        is never refilled with stale records; the legacy files are left untouched.
+        """
+        with self.get_connection() as conn:
+            if conn.execute(f'SELECT 1 FROM {META_TABLE} WHERE key = ?', (LEGACY_HISTORY_MIGRATED,)).fetchone():
+                return 0
+        
+        records = read_legacy_records(journal_path, history_path)
+        
+        def migrate(conn):
+            # Checked again in the write transaction: kiosk and report processes may start together
+            if conn.execute(f'SELECT 1 FROM {META_TABLE} WHERE key = ?', (LEGACY_HISTORY_MIGRATED,)).fetchone():
+                return 0
+            imported = 0
+            if records and conn.execute('SELECT COUNT(*) FROM attendance_records').fetchone()[0] == 0:
+                insert_history_records(conn, records)
+                imported = len(records)
+            conn.execute(f'INSERT INTO {META_TABLE} (key, value) VALUES (?, ?)',
+                         (LEGACY_HISTORY_MIGRATED, datetime.now().isoformat()))
+            return imported
+        
+        imported = self._db.write(migrate)
+        logger.info(f"Legacy attendance history migrated ({imported} records)")
+        return imported
+    
+    def export_history_csv(self, path: Path = HISTORY_FILE) -> Path:
+        """Export all records as the legacy attendance_history.csv."""
+        path = Path(path)
+        # Exports from other threads/processes are serialized; readers always see a complete file
+        with file_lock(path), atomic_write(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(HISTORY_COLUMNS)
+            writer.writerows(values for _, _, values in self.get_history_rows())
+        
+        logger.info(f"Exported attendance history to {path}")
+        return path
+    
+    def pulled_revision(self) -> int:
+        """Get the hub revision up to which records of the sync hub have been merged."""
+        with self.get_connection() as conn:
+            row = conn.execute(f'SELECT value FROM {META_TABLE} WHERE key = ?', (HUB_PULLED_REVISION,)).fetchone()
+        return int(row['value']) if row else 0
+    
+    def merge_remote_records(self, kiosk_id: str, records: List[Dict[str, Any]], revision: int) -> int:
+        """
+        Merge records pulled from the sync hub (every kiosk's, keyed by kiosk_id and record_id)
+        and remember revision as pulled. This kiosk's own records are matched by ID, those of
+        other kiosks by their origin, so a student can scan out at another kiosk.
+        A record with a local change that is not uploaded yet keeps it (the upload reaches the
+        hub next), and the hub's copies of this kiosk's own uploads are skipped.
+        Merged records are stored as synced; returns the number of records changed.
+        """
+        def merge(conn) -> int:
+            changed = 0
+            for record in records:
+                if record['kiosk_id'] == kiosk_id:
+                    local = conn.execute('''
+                        SELECT id, synced, updated_at FROM attendance_records
+                        WHERE id = ? AND origin_kiosk IS NULL
+                    ''', (int(record['record_id']),)).fetchone()
+                    if local is None:
+                        continue  # deleted here (retention); not brought back
+                else:
+                    local = conn.execute('''
+                        SELECT id, synced, updated_at FROM attendance_records
+                        WHERE origin_kiosk = ? AND origin_id = ?
+                    ''', (record['kiosk_id'], int(record['record_id']))).fetchone()
+                if local is not None and (not local['synced'] or local['updated_at'] == record['updated_at']):
+                    continue
+                    
+                coded, extras = split_responses(record.get('responses'))
+                values = (record['student_id'], record['student_name'], record['entry_time'],
+                          record.get('exit_time') or None,
+                          *(response_code(conn, field, coded.get(field)) for field in RESPONSE_FIELDS),
+                          json.dumps(extras) if extras else None, record['updated_at'], next_revision(conn))
+                if local is None:
+                    conn.execute('''
+                        INSERT INTO attendance_records
+                        (student_id, student_name, entry_time, exit_time, mood_id, sleep_id, purpose_id, responses,
+                         updated_at, revision, synced, created_at, origin_kiosk, origin_id)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, TRUE, ?, ?, ?)
+                    ''', values + (datetime.now().isoformat(), record['kiosk_id'], int(record['record_id'])))
+                else:
+                    conn.execute('''
+                        UPDATE attendance_records
+                        SET student_id = ?, student_name = ?, entry_time = ?, exit_time = ?, mood_id = ?,
+                            sleep_id = ?, purpose_id = ?, responses = ?, updated_at = ?, revision = ?, synced = TRUE
+                        WHERE id = ?
+                    ''', values + (local['id'],))
+                changed += 1
+                
+            conn.execute(f'INSERT OR REPLACE INTO {META_TABLE} (key, value) VALUES (?, ?)',
+                         (HUB_PULLED_REVISION, str(revision)))
+            return changed
+            
+        changed = self._db.write(merge)
+        if changed:
+            logger.info(f"Merged {changed} records from the sync hub (hub revision {revision})")
+        return changed
+    
+    def get_unsynced_records(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get unsynced records (oldest first, at most limit) for cloud synchronization."""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    SELECT * FROM attendance_records 
-                    WHERE synced = FALSE 
-                    ORDER BY entry_time ASC
-                ''')
+                cursor.execute(f'''
+                    {RECORD_SELECT}
+                    WHERE r.synced = FALSE
+                    ORDER BY r.entry_time ASC
+                    LIMIT ?
+                ''', (-1 if limit is None else limit,))
                 
-                records = []
-                for row in cursor.fetchall():
-                    record = dict(row)
-                    if record['responses']:
-                        record['responses'] = json.loads(record['responses'])
-                    records.append(record)
+                records = [record_dict(row) for row in cursor.fetchall()]
                 
-                logger.info(f"Found {len(records)} unsynced records")
+                logger.debug(f"Found {len(records)} unsynced records")
                 return records
                 
         except Exception as e:
             logger.error(f"Failed to get unsynced records: {e}")
             return []
     
-    def mark_records_synced(self, record_ids: List[int]) -> bool:
-        """Mark records as synced after successful cloud upload."""
+    def mark_records_synced(self, record_ids: List[int], up_to_revision: Optional[int] = None) -> bool:
+        """
+        Mark records as synced after successful cloud upload.
+        With up_to_revision, records changed again after the upload (higher revision) stay unsynced.
+        """
+        def update(conn):
+            placeholders = ','.join('?' * len(record_ids))
+            revision_filter = "" if up_to_revision is None else f"AND revision <= {int(up_to_revision)}"
+            conn.execute(f'''
+                UPDATE attendance_records
+                SET synced = TRUE, updated_at = ?
+                WHERE id IN ({placeholders}) {revision_filter}
+            ''', [datetime.now().isoformat()] + record_ids)
+            
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                placeholders = ','.join('?' * len(record_ids))
-                cursor.execute(f'''
-                    UPDATE attendance_records 
-                    SET synced = TRUE, updated_at = ?
-                    WHERE id IN ({placeholders})
-                ''', [datetime.now().isoformat()] + record_ids)
-                
-                conn.commit()
-                logger.info(f"Marked {len(record_ids)} records as synced")
-                return True
-                
+            self._db.write(update)
+            logger.info(f"Marked {len(record_ids)} records as synced")
+            return True
+            
         except Exception as e:
             logger.error(f"Failed to mark records as synced: {e}")
             return False
     
-    def log_sync_attempt(self, action: str, status: str, message: str = None, record_count: int = 0):
-        """Log synchronization attempts."""
+    def log_sync_attempt(self, action: str, status: str, message: str = None, record_count: int = 0,
+                         duration_ms: Optional[float] = None):
+        """Log synchronization attempts, with latency and throughput when the duration is known."""
+        throughput = None
+        if duration_ms and record_count:
+            throughput = record_count / (duration_ms / 1000)
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    INSERT INTO sync_log (timestamp, action, status, message, record_count)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (datetime.now().isoformat(), action, status, message, record_count))
-                
-                conn.commit()
-                
+            self._db.write(lambda conn: conn.execute('''
+                INSERT INTO sync_log (timestamp, action, status, message, record_count, duration_ms, records_per_second)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (datetime.now().isoformat(), action, status, message, record_count, duration_ms, throughput)))
+            
         except Exception as e:
             logger.error(f"Failed to log sync attempt: {e}")
     
@@ -249,47 +668,97 @@ class OfflineStorage:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    SELECT * FROM attendance_records 
-                    ORDER BY entry_time DESC 
+                cursor.execute(f'''
+                    {RECORD_SELECT}
+                    ORDER BY r.entry_time DESC
                     LIMIT ?
                 ''', (limit,))
                 
-                records = []
-                for row in cursor.fetchall():
-                    record = dict(row)
-                    if record['responses']:
-                        record['responses'] = json.loads(record['responses'])
-                    records.append(record)
-                
-                return records
+                return [record_dict(row) for row in cursor.fetchall()]
                 
         except Exception as e:
             logger.error(f"Failed to get recent records: {e}")
             return []
     
-    def cleanup_old_records(self, days: int = 30) -> int:
-        """Clean up old synced records to save space."""
+    def cleanup_old_records(self, days: int = 30, chunk_size: int = 500, synced_only: bool = True,
+                            archive: Optional[Callable[[List[Tuple[int, int, List[str]]]], None]] = None,
+                            max_revision: Optional[int] = None) -> int:
+        """
+        Delete records whose entry is older than the given number of days, in chunks so the
+        write lock is only held briefly. With synced_only, records not yet uploaded are kept;
+        with max_revision, records changed after that revision are kept.
+        archive receives each chunk as (record_id, revision, values) before it is deleted;
+        if it raises, cleanup stops and the chunk stays in the database.
+        """
+        # entry_time is stored in TIMESTAMP_FORMAT, which sorts chronologically as text
+        cutoff = (datetime.now() - timedelta(days=days)).strftime(TIMESTAMP_FORMAT)
+        filters = ["AND r.synced = TRUE"] if synced_only else []
+        if max_revision is not None:
+            filters.append(f"AND r.revision <= {int(max_revision)}")
+        select_sql = f'''
+            {RECORD_SELECT}
+            WHERE r.entry_time < ? {' '.join(filters)}
+            ORDER BY r.entry_time
+            LIMIT ?
+        '''
+        
+        deleted_count = 0
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                cutoff_date = datetime.now().replace(day=datetime.now().day - days).isoformat()
-                
-                cursor.execute('''
-                    DELETE FROM attendance_records 
-                    WHERE synced = TRUE AND created_at < ?
-                ''', (cutoff_date,))
-                
-                deleted_count = cursor.rowcount
-                conn.commit()
-                
-                logger.info(f"Cleaned up {deleted_count} old records")
-                return deleted_count
+            while True:
+                with self.get_connection() as conn:
+                    rows = conn.execute(select_sql, (cutoff, chunk_size)).fetchall()
+                if not rows:
+                    break
+                chunk = [(row['id'], row['revision'], history_values(row)) for row in rows]
+                if archive is not None:
+                    archive(chunk)
+                    
+                # Records changed since they were read (new revision) are left for the next run
+                deleted = self._db.write(lambda conn: conn.executemany(
+                    'DELETE FROM attendance_records WHERE id = ? AND revision = ?',
+                    [(record_id, revision) for record_id, revision, _ in chunk]).rowcount)
+                deleted_count += deleted
+                if deleted == 0 or len(rows) < chunk_size:
+                    break
+                    
+            logger.info(f"Cleaned up {deleted_count} records older than {days} days")
+            return deleted_count
+            
+        except Exception as e:
+            logger.error(f"Failed to cleanup old records (after {deleted_count} deleted): {e}")
+            return deleted_count
+    
+    def vacuum(self, max_pages: int = 0) -> int:
+        """
+        Return free pages to the file system with incremental vacuum (all of them if max_pages is 0)
+        and return the number released. The first run converts the database to
+        auto_vacuum=INCREMENTAL, which needs one full VACUUM.
+        """
+        with self.get_connection() as conn:
+            auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+            free_before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            
+        try:
+            if auto_vacuum != 2:  # 2 = INCREMENTAL
+                logger.info(f"Converting {self.db_path} to incremental auto-vacuum")
+                self._db.write(lambda conn: conn.executescript('PRAGMA auto_vacuum=INCREMENTAL; VACUUM;'),
+                               transaction=False)
+            elif free_before:
+                # executescript steps the pragma to completion (execute() frees a single page)
+                self._db.write(lambda conn: conn.executescript(f'PRAGMA incremental_vacuum({int(max_pages)});'),
+                               transaction=False)
+            # With WAL the file only shrinks once the released pages are checkpointed
+            self._db.write(lambda conn: conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone(),
+                           transaction=False)
                 
+            with self.get_connection() as conn:
+                released = free_before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+            logger.info(f"Vacuumed {self.db_path}: released {released} pages")
+            return released
+            
         except Exception as e:
-            logger.error(f"Failed to cleanup old records: {e}")
+            logger.error(f"Failed to vacuum database: {e}")
             return 0
-
+            
 # Global offline storage instance
 offline_storage = OfflineStorage()
\ No newline at end of file
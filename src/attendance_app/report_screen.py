@@ -14,7 +14,7 @@ from kivy.core.text import LabelBase
 
 from attendance_app.report_system.excel_report_generator import generate_excel_reports
 from attendance_app.report_system.utils import get_current_month_year, list_generated_reports
-from attendance_app.spreadsheet import sync_attendance_to_excel # 追加
+from attendance_app.spreadsheet import export_attendance_history, sync_attendance_to_excel # 追加
 
 # フォント設定を動的に取得（font_manager.pyの関数を利用）
 try:
@@ -167,10 +167,14 @@ class ReportScreen(Screen):
     def _sync_to_excel_thread(self):
         try:
             success = sync_attendance_to_excel()
+            # attendance_history.csv も最新の出席記録で書き出す
+            exported = export_attendance_history()
             if success:
                 message = "出席情報がExcelに同期されました。"
             else:
                 message = "出席情報のExcel同期に失敗しました。ログを確認してください。"
+            if not exported:
+                message += "\nattendance_history.csv の書き出しに失敗しました。"
             Clock.schedule_once(lambda dt: self.on_sync_complete(message))
         except Exception as e:
             Clock.schedule_once(lambda dt: self.on_sync_error(str(e)))
@@ -1,12 +1,77 @@
+import unicodedata
 from datetime import datetime
 from typing import Dict, List, Optional
 import pandas as pd
 
-from attendance_app.path_manager import get_asset_path, get_output_dir, get_base_dir
+from attendance_app.path_manager import get_asset_path, get_base_dir
+from attendance_app.history_cache import load_history_frame
+from attendance_app.history_partitions import history_partitions
+from attendance_app.offline_storage import RESPONSE_CODES
 
-ATTENDANCE_HISTORY_FILE = get_output_dir() / "attendance_history.csv"
 STUDENT_DATA_FILE = get_base_dir() / "src" / "attendance_app" / "assets" / "sample_data.csv"
 
+# 集計する選択肢（キオスクの表示順）。回答がなくても0回として表示する
+MOOD_CHOICES = list(RESPONSE_CODES["Mood"][2])
+PURPOSE_CHOICES = list(RESPONSE_CODES["Purpose"][2])
+
+# 睡眠満足度のビーカーの段階（％）とレポートでの表記
+SLEEP_LABELS = {0: "０％", 25: "２５％", 50: "５０％", 75: "７５％", 100: "１００％"}
+
+def normalize_answers(values: pd.Series) -> pd.Series:
+    """
+    回答の表記ゆれ（全角・半角、前後の空白）を揃え、未回答を NaN にする。
+    正規化は異なる値ごとに1回だけ行い、列全体には辞書で一括適用する。
+    """
+    text = values.astype(object).where(values.notna(), '').astype(str)
+    mapping = {value: unicodedata.normalize('NFKC', value).strip() for value in text.unique()}
+    normalized = text.map(mapping).astype(object)
+    return normalized.where(normalized != '')
+
+
+def sleep_levels(values: pd.Series) -> pd.Series:
+    """睡眠満足度の回答（"100％", "１００％", "75%" など）を数値（％）に変換。変換できない回答は NaN"""
+    return pd.to_numeric(normalize_answers(values).str.rstrip('%'), errors='coerce')
+
+
+def _count_by_student(student_ids: pd.Series, answers: pd.Series, choices: List[str]) -> Dict[str, Dict[str, int]]:
+    """生徒ごとの回答数を一括で集計。選択肢は常に含め、それ以外の回答は1回以上あるときだけ含める"""
+    counts = (pd.DataFrame({"student": student_ids, "answer": answers})
+              .groupby(["student", "answer"], sort=False).size().unstack(fill_value=0))
+    columns = choices + [answer for answer in counts.columns if answer not in choices]
+    counts = counts.reindex(columns=columns, fill_value=0)
+    return {student_id: {answer: int(count) for answer, count in zip(columns, row) if count or answer in choices}
+            for student_id, row in zip(counts.index, counts.to_numpy())}
+
+
+def summarize_answers(df: pd.DataFrame) -> Dict[str, dict]:
+    """
+    対象月の全生徒について、気分・睡眠・目的の集計を1回の groupby でまとめて計算する。
+    戻り値は {生徒ID: {"mood_distribution", "sleep_stats", "purpose_distribution"}}。
+    """
+    student_ids = df['StudentID']
+    moods = _count_by_student(student_ids, normalize_answers(df['Mood']), MOOD_CHOICES)
+    purposes = _count_by_student(student_ids, normalize_answers(df['Purpose']), PURPOSE_CHOICES)
+
+    # 睡眠は段階の数値から平均を求め、分布は最も近いビーカーの段階に数える
+    levels = sleep_levels(df['Sleep_Satisfaction'])
+    nearest = ((levels.clip(0, 100) / 25).round() * 25).map(SLEEP_LABELS)
+    sleep_counts = _count_by_student(student_ids, nearest, list(SLEEP_LABELS.values()))
+    sleep_averages = levels.groupby(student_ids, sort=False).mean().round(1)
+
+    summaries = {}
+    for student_id in student_ids.unique():
+        average = sleep_averages.get(student_id)
+        summaries[student_id] = {
+            "mood_distribution": moods.get(student_id, dict.fromkeys(MOOD_CHOICES, 0)),
+            "sleep_stats": {
+                "average_percentage": 0 if average is None or pd.isna(average) else float(average),
+                "distribution": sleep_counts.get(student_id, dict.fromkeys(SLEEP_LABELS.values(), 0)),
+            },
+            "purpose_distribution": purposes.get(student_id, dict.fromkeys(PURPOSE_CHOICES, 0)),
+        }
+    return summaries
+
+
 def get_student_name_mapping() -> Dict[str, str]:
     """塾生番号から名前へのマッピングを取得"""
     if not STUDENT_DATA_FILE.exists():
@@ -14,83 +79,102 @@ def get_student_name_mapping() -> Dict[str, str]:
     df = pd.read_csv(STUDENT_DATA_FILE, dtype=str, encoding='utf-8')
     return pd.Series(df.StudentName.values, index=df.StudentID).to_dict()
 
-def get_monthly_attendance_data(student_id: str, year: int, month: int) -> dict:
+
+class MonthlyAttendanceFrame:
     """
-    指定生徒の月次出席データを取得・分析
+    1か月分の出席履歴を1回だけ読み込み・パースし、生徒ごとに分割して保持する。
+    レポート生成1回につき1つ作成し、各生徒のシート作成に使い回す。
     """
-    if not ATTENDANCE_HISTORY_FILE.exists():
-        return {}
 
-    name_mapping = get_student_name_mapping()
-    student_name = name_mapping.get(student_id, "Unknown")
-
-    try:
-        df = pd.read_csv(ATTENDANCE_HISTORY_FILE, dtype=str, encoding='utf-8-sig')
-        # 複数の日付フォーマットに対応してパース
-        def parse_datetime_flexible(dt_str):
-            if pd.isna(dt_str) or dt_str == '':
-                return pd.NaT
-            # 複数のフォーマットを試行
-            formats = [
-                '%Y/%m/%d %H:%M',
-                '%Y/%m/%d %H:%M:%S', 
-                '%Y/%m/%d %H:%M:%S.%f',
-                '%Y-%m-%d %H:%M:%S',
-                '%Y-%m-%d %H:%M'
-            ]
-            for fmt in formats:
-                try:
-                    return pd.to_datetime(dt_str, format=fmt)
-                except:
-                    continue
-            # フォーマットが合わない場合は汎用パーサーを使用
-            return pd.to_datetime(dt_str, errors='coerce')
-        
-        df['Entry_Time'] = df['Entry_Time'].apply(parse_datetime_flexible)
-        df['Exit_Time'] = df['Exit_Time'].apply(parse_datetime_flexible)
-    except Exception as e:
-        print(f"Error reading attendance history CSV: {e}")
-        return {}
-    # Entry_Timeと StudentIDが有効で、Exit_Timeも有効な行のみ取得（完了した出席記録）
-    df = df.dropna(subset=['Entry_Time', 'StudentID'])
-    df = df[df['Exit_Time'].notna()]
-
-    # Filter for the specific student and month
-    student_df = df[(df['StudentID'] == student_id) & 
-                    (df['Entry_Time'].dt.year == year) & 
-                    (df['Entry_Time'].dt.month == month)].copy()
-
-    if student_df.empty:
-        return {"student_name": student_name, "attendance_count": 0, "daily_records": []}
-
-    student_df['StayMinutes'] = (student_df['Exit_Time'] - student_df['Entry_Time']).dt.total_seconds() / 60
-
-    daily_records = []
-    for _, row in student_df.iterrows():
-        daily_records.append({
-            "date": row['Entry_Time'].strftime("%Y-%m-%d"),
-            "entry_time": row['Entry_Time'].strftime("%H:%M"),
-            "exit_time": row['Exit_Time'].strftime("%H:%M"),
-            "stay_minutes": round(row['StayMinutes']),
-            "mood": row.get('Mood', ''),
-            "sleep_satisfaction": row.get('Sleep_Satisfaction', ''),
-            "purpose": row.get('Purpose', '')
+    def __init__(self, year: int, month: int):
+        self.year = year
+        self.month = month
+        self.available = False
+        self.name_mapping = get_student_name_mapping()
+        self._groups: Dict[str, pd.DataFrame] = {}
+        self._answers: Dict[str, dict] = {}
+        self._load()
+
+    def _load(self):
+        try:
+            # SQLiteの出席記録から月別の履歴を最新化し、対象月のパーティションだけを読み込む
+            partition_path = history_partitions.partition_path(self.year, self.month)
+            if partition_path is None:
+                # 対象月の記録がない
+                self.available = True
+                return
+            # 列キャッシュ（パース済みの型付き配列）から読み込む。CSVが更新されていれば再構築される
+            df = load_history_frame(partition_path)
+        except Exception as e:
+            print(f"Error reading attendance history CSV: {e}")
+            return
+
+        # Entry_Timeと StudentIDが有効で、Exit_Timeも有効な行のみ取得（完了した出席記録）
+        df = df.dropna(subset=['Entry_Time', 'StudentID'])
+        df = df[df['Exit_Time'].notna()]
+
+        # 対象月の行だけを残し、滞在時間をまとめて計算
+        df = df[(df['Entry_Time'].dt.year == self.year) &
+                (df['Entry_Time'].dt.month == self.month)].copy()
+        # 対象月の行だけになってから、カテゴリ列を通常の文字列列に戻す
+        for column in ['StudentID', 'Name', 'Mood', 'Sleep_Satisfaction', 'Purpose']:
+            df[column] = df[column].astype(object)
+        df['StayMinutes'] = (df['Exit_Time'] - df['Entry_Time']).dt.total_seconds() / 60
+
+        self._groups = {student_id: group for student_id, group in df.groupby('StudentID', sort=False)}
+        # アンケート回答の集計は全生徒分をまとめて計算しておく
+        self._answers = summarize_answers(df)
+        self.available = True
+
+    def student_ids(self) -> List[str]:
+        """対象月に出席記録がある生徒IDの一覧（履歴に現れた順）"""
+        return list(self._groups)
+
+    def students_with_attendance(self) -> List[dict]:
+        """対象月に出席記録があり、名簿に登録されている生徒のリスト"""
+        return [{"id": student_id, "name": self.name_mapping[student_id]}
+                for student_id in self._groups if student_id in self.name_mapping]
+
+    def get_student_data(self, student_id: str) -> dict:
+        """指定生徒の月次出席データ（get_monthly_attendance_data と同じ形式）"""
+        if not self.available:
+            return {}
+
+        student_name = self.name_mapping.get(student_id, "Unknown")
+        student_df = self._groups.get(student_id)
+        if student_df is None or student_df.empty:
+            return {"student_name": student_name, "attendance_count": 0, "daily_records": []}
+
+        responses = student_df.reindex(columns=['Mood', 'Sleep_Satisfaction', 'Purpose']).fillna('')
+        records = pd.DataFrame({
+            "date": student_df['Entry_Time'].dt.strftime("%Y-%m-%d"),
+            "entry_time": student_df['Entry_Time'].dt.strftime("%H:%M"),
+            "exit_time": student_df['Exit_Time'].dt.strftime("%H:%M"),
+            "stay_minutes": student_df['StayMinutes'].round().astype(int),
+            "mood": responses['Mood'],
+            "sleep_satisfaction": responses['Sleep_Satisfaction'],
+            "purpose": responses['Purpose'],
         })
+        daily_records = records.to_dict('records')
+        answers = self._answers[student_id]
+
+        return {
+            "student_name": student_name,
+            "attendance_count": len(daily_records),
+            "average_stay_minutes": round(student_df['StayMinutes'].mean(), 1),
+            "daily_records": daily_records,
+            "mood_distribution": answers["mood_distribution"],
+            "sleep_stats": answers["sleep_stats"],
+            "purpose_distribution": answers["purpose_distribution"]
+        }
 
-    # Dummy data for distributions as they are not fully implemented in the new CSV structure
-    mood_count = {"快晴": 0, "晴れ": 0, "くもり": 0}
-    sleep_count = {"０％": 0, "２５％": 0, "５０％": 0, "７５％": 0, "１００％": 0}
-    purpose_count = {"学ぶ": 0, "来る": 0}
-
-    return {
-        "student_name": student_name,
-        "attendance_count": len(daily_records),
-        "average_stay_minutes": round(student_df['StayMinutes'].mean(), 1),
-        "daily_records": daily_records,
-        "mood_distribution": mood_count,
-        "sleep_stats": {"average_percentage": 0, "distribution": sleep_count},
-        "purpose_distribution": purpose_count
-    }
+
+def get_monthly_attendance_data(student_id: str, year: int, month: int) -> dict:
+    """
+    指定生徒の月次出席データを取得・分析
+    複数の生徒を処理する場合は MonthlyAttendanceFrame を直接使うこと
+    """
+    return MonthlyAttendanceFrame(year, month).get_student_data(student_id)
 
 def get_all_students_list() -> List[dict]:
     """登録されている全生徒のリストを取得"""
@@ -99,45 +183,4 @@ def get_all_students_list() -> List[dict]:
 
 def get_students_with_attendance(year: int, month: int) -> List[dict]:
     """指定月に出席記録がある生徒のリストを取得"""
-    if not ATTENDANCE_HISTORY_FILE.exists():
-        return []
-
-    try:
-        df = pd.read_csv(ATTENDANCE_HISTORY_FILE, dtype=str, encoding='utf-8-sig')
-        # 同じ日付パース関数を使用
-        def parse_datetime_flexible(dt_str):
-            if pd.isna(dt_str) or dt_str == '':
-                return pd.NaT
-            formats = [
-                '%Y/%m/%d %H:%M',
-                '%Y/%m/%d %H:%M:%S', 
-                '%Y/%m/%d %H:%M:%S.%f',
-                '%Y-%m-%d %H:%M:%S',
-                '%Y-%m-%d %H:%M'
-            ]
-            for fmt in formats:
-                try:
-                    return pd.to_datetime(dt_str, format=fmt)
-                except:
-                    continue
-            return pd.to_datetime(dt_str, errors='coerce')
-        
-        df['Entry_Time'] = df['Entry_Time'].apply(parse_datetime_flexible)
-        df['Exit_Time'] = df['Exit_Time'].apply(parse_datetime_flexible)
-    except Exception as e:
-        print(f"Error reading attendance history CSV for student list: {e}")
-        return []
-    # 完了した出席記録のみ取得
-    df = df.dropna(subset=['Entry_Time', 'StudentID'])
-    df = df[df['Exit_Time'].notna()]
-
-    monthly_df = df[(df['Entry_Time'].dt.year == year) & (df['Entry_Time'].dt.month == month)]
-    students_with_attendance = monthly_df['StudentID'].unique()
-
-    name_mapping = get_student_name_mapping()
-    result = []
-    for student_id in students_with_attendance:
-        if student_id in name_mapping:
-            result.append({"id": student_id, "name": name_mapping[student_id]})
-    
-    return result
+    return MonthlyAttendanceFrame(year, month).students_with_attendance()
@@ -1,34 +1,305 @@
-from datetime import datetime
-from typing import List, Dict, Optional
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+from datetime import datetime, timezone
+from itertools import repeat
+from pathlib import Path
+from zipfile import ZipFile, ZIP_DEFLATED
+from typing import Any, Iterable, List, Dict, Optional, Tuple
 from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+from openpyxl.cell import Cell
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side, NamedStyle
+from openpyxl.styles.borders import DEFAULT_BORDER
+from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+from openpyxl.worksheet.merge import MergedCellRange
 from openpyxl.worksheet.page import PageMargins
+from openpyxl.worksheet.worksheet import Worksheet
 from openpyxl.drawing.image import Image
-from openpyxl.worksheet.datavalidation import DataValidation
-from attendance_app.report_system.data_analyzer import get_monthly_attendance_data, get_students_with_attendance
+from openpyxl.writer.excel import ExcelWriter
+from openpyxl.worksheet.datavalidation import DataValidation, DataValidationList
+from openpyxl.utils import column_index_from_string
 from attendance_app.path_manager import get_output_dir, get_image_path
+from attendance_app.settings import settings_manager
+
+# ワーカープロセスでは print が見えないため、スキップした生徒はログ（attendance.log）に残す
+logger = logging.getLogger(__name__)
+
+# data_analyzer（履歴・データベース）は集計を行う親プロセスでだけ読み込む。
+# ワーカープロセスは集計済みのデータからシートを描画するだけなので、各メソッド内でインポートする
+
+# 1プロセスあたりの最少生徒数（これより少ないとプロセス起動の方が高くつくため、その分ワーカーを減らす）
+MIN_STUDENTS_PER_WORKER = 8
+
+# レポートの名前付きスタイル
+STYLE_TITLE = "report_title"
+STYLE_STUDENT = "report_student"
+STYLE_HEADER = "report_header"
+STYLE_DATA = "report_data"
+STYLE_HEADING = "report_heading"
+STYLE_COMMENT = "report_comment"
+
+
+def _report_styles() -> List[NamedStyle]:
+    """レポートの名前付きスタイル（NamedStyle は1つのワークブックにしか登録できないため毎回作る）"""
+    thin = Side(style='thin')
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    return [
+        # タイトル・生徒氏名（テンプレート完全準拠）
+        NamedStyle(name=STYLE_TITLE, font=Font(name='UD デジタル 教科書体 NK', size=24, bold=False),
+                   alignment=Alignment(horizontal='center', vertical='center'), border=DEFAULT_BORDER),
+        NamedStyle(name=STYLE_STUDENT, font=Font(name='UD デジタル 教科書体 NK', size=20, bold=False),
+                   alignment=Alignment(horizontal='right', vertical='center'), border=DEFAULT_BORDER),
+        # 表のヘッダー・データ
+        NamedStyle(name=STYLE_HEADER, font=Font(name='メイリオ', size=12, bold=True, color='FFFFFF'),
+                   fill=PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid'),
+                   alignment=Alignment(horizontal='center', vertical='center', wrap_text=True), border=border),
+        NamedStyle(name=STYLE_DATA, font=Font(name='メイリオ', size=11),
+                   alignment=Alignment(horizontal='center', vertical='center'), border=border),
+        # サマリー・コメント欄タイトル、コメント欄
+        NamedStyle(name=STYLE_HEADING, font=Font(name='メイリオ', size=13, bold=True), border=DEFAULT_BORDER),
+        NamedStyle(name=STYLE_COMMENT, font=Font(name='メイリオ', size=11),
+                   alignment=Alignment(horizontal='left', vertical='top', wrap_text=True), border=border),
+    ]
+
+
+def register_report_styles(workbook: Workbook) -> None:
+    """レポートの名前付きスタイルをワークブックに登録（ワークブックごとに1回）"""
+    for style in _report_styles():
+        if style.name not in workbook.named_styles:
+            workbook.add_named_style(style)
+
+
+# ロゴ画像（高さ62%、縦横比固定）
+LOGO_IMAGE = "Onedrop_logo/Onedrop_logo_transparent.png"
+LOGO_SCALE = 0.62
+
+# 画像ファイルのパス -> (画像データ, 表示幅, 表示高さ)。画像のデコードはプロセスごとに1回
+_image_cache: Dict[str, Tuple[bytes, int, int]] = {}
+
+
+class SharedImage(Image):
+    """
+    読み込み済みの画像データを使い回す Image。シートごとに作っても画像を開き直さず、
+    同じ name の画像は save_report_workbook() でファイルに1回だけ保存される。
+    """
+    
+    def __init__(self, data: bytes, width: int, height: int, name: str, image_format: str = "png"):
+        # Image.__init__ は Pillow で画像を開き直すため呼ばない
+        self.ref = None
+        self._bytes = data
+        self.width = width
+        self.height = height
+        self.name = name
+        self.format = image_format
+    
+    def _data(self) -> bytes:
+        return self._bytes
+    
+    @property
+    def path(self) -> str:
+        return f"/xl/media/{self.name}.{self.format}"
+
+
+def load_scaled_image(image_path: Path, scale: float) -> Tuple[bytes, int, int]:
+    """画像データと、高さを scale 倍にした表示サイズ（縦横比固定）を返す（プロセス内でキャッシュ）"""
+    key = str(image_path)
+    cached = _image_cache.get(key)
+    if cached is None:
+        image = Image(key)
+        new_height = int(image.height * scale)
+        new_width = int(new_height * (image.width / image.height))
+        cached = (image._data(), new_width, new_height)
+        _image_cache[key] = cached
+    return cached
+
+
+class _ReportExcelWriter(ExcelWriter):
+    """同じパスの画像（SharedImage）をパッケージに1回だけ書き込む ExcelWriter"""
+    
+    def _write_images(self):
+        written = set()
+        for img in self._images:
+            if img.path not in written:
+                written.add(img.path)
+                self._archive.writestr(img.path[1:], img._data())
+
+
+def save_report_workbook(workbook: Workbook, filename: str) -> None:
+    """ワークブックを保存（Workbook.save と同じ。ただし全シートのロゴは1つの画像ファイルを参照する）"""
+    if workbook.write_only and not workbook.worksheets:
+        workbook.create_sheet()
+    archive = ZipFile(filename, 'w', ZIP_DEFLATED, allowZip64=True)
+    workbook.properties.modified = datetime.now(tz=timezone.utc).replace(tzinfo=None)
+    _ReportExcelWriter(workbook, archive).save()
+
+
+def report_worker_count(workers: Optional[int] = None) -> int:
+    """レポート生成に使うワーカープロセス数（REPORT_WORKERS。0 ならCPUコア数）"""
+    if workers is None:
+        workers = settings_manager.settings.report_workers
+    return workers if workers > 0 else (os.cpu_count() or 1)
+
+
+def report_streaming(streaming: Optional[bool] = None) -> bool:
+    """シートを1枚ずつディスクに書き出す書き込み専用モードを使うか（REPORT_STREAMING）"""
+    if streaming is None:
+        streaming = settings_manager.settings.report_streaming
+    return streaming
+
+
+def compile_ranges(cells: Iterable[Tuple[int, int]]) -> List[str]:
+    """
+    セル（行, 列）の集まりを、それをちょうど覆う長方形の範囲（"G5:I20" など）にまとめる。
+    行ごとに連続する列をまとめ、同じ列の並びが続く行は縦につなげる。
+    """
+    columns_by_row: Dict[int, List[int]] = {}
+    for row, column in cells:
+        columns_by_row.setdefault(row, []).append(column)
+    
+    closed = []
+    # 直前の行まで続いている範囲：(開始列, 終了列) -> [開始行, 終了行]
+    open_ranges: Dict[Tuple[int, int], List[int]] = {}
+    for row in sorted(columns_by_row):
+        columns = sorted(set(columns_by_row[row]))
+        spans = []
+        start = previous = columns[0]
+        for column in columns[1:]:
+            if column != previous + 1:
+                spans.append((start, previous))
+                start = column
+            previous = column
+        spans.append((start, previous))
+        
+        continued = {}
+        for span in spans:
+            rows = open_ranges.pop(span, None)
+            if rows is not None and rows[1] == row - 1:
+                rows[1] = row
+            else:
+                if rows is not None:
+                    closed.append((span, rows))
+                rows = [row, row]
+            continued[span] = rows
+        closed.extend(open_ranges.items())
+        open_ranges = continued
+    closed.extend(open_ranges.items())
+    
+    closed.sort(key=lambda item: (item[1][0], item[0][0]))
+    return [CellRange(min_col=first_col, min_row=first_row, max_col=last_col, max_row=last_row).coord
+            for (first_col, last_col), (first_row, last_row) in closed]
+
+
+def _process_pool(workers: int) -> ProcessPoolExecutor:
+    # Windows と同じ spawn を常に使う（fork はスレッドを使うアプリでは安全でない）
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def _save_student_report(year: int, month: int, student: Tuple[str, Dict]) -> str:
+    """ワーカープロセス：集計済みデータから1人分のレポートファイルを作成"""
+    student_id, attendance_data = student
+    return ExcelReportGenerator().generate_single_student_report(
+        student_id, year, month, attendance_data=attendance_data)
 
 
 class ExcelReportGenerator:
     """Excel形式の出席レポート生成クラス"""
     
-    def __init__(self):
+    def __init__(self, workers: Optional[int] = None, streaming: Optional[bool] = None):
         self.workbook = None
         self.output_dir = get_output_dir()
+        # None なら REPORT_WORKERS の設定に従う
+        self.workers = workers
+        # True ならシートを1枚ずつ一時ファイルに書き出して閉じる（None なら REPORT_STREAMING の設定に従う）
+        self.streaming = report_streaming(streaming)
+        # シートごとの書き込み済みの最終行（行は上から順に1行ずつ書く）
+        self._last_rows: Dict[Any, int] = {}
     
     def create_workbook(self) -> Workbook:
-        """新しいワークブックを作成"""
-        self.workbook = Workbook()
+        """新しいワークブックを作成（ストリーミングでは書き込み専用）"""
+        self.workbook = Workbook(write_only=self.streaming)
         # デフォルトシートを削除
         if 'Sheet' in self.workbook.sheetnames:
             self.workbook.remove(self.workbook['Sheet'])
+        # スタイルは名前付きスタイルとして1回だけ登録し、セルには名前で適用する
+        register_report_styles(self.workbook)
         return self.workbook
     
+    def write_row(self, worksheet, row: int, values: List[Any], style: Optional[str] = None,
+                  height: Optional[float] = None):
+        """
+        row 行目の値を1行まとめて書き込む。シートは上から順に書き、飛ばした行は空行になる。
+        style は値のあるセル（空文字を含む）に適用する名前付きスタイル。
+        """
+        last_row = self._last_rows.get(worksheet, 0)
+        if row <= last_row:
+            raise ValueError(f"行は上から順に書き込む必要があります（{row}行目は書き込み済み）")
+        for _ in range(row - last_row - 1):
+            worksheet.append([])
+        if height is not None:
+            worksheet.row_dimensions[row].height = height
+            
+        cells = []
+        for column, value in enumerate(values, 1):
+            if value is None or isinstance(value, Cell):
+                cells.append(value)
+                continue
+            # 書き込み専用シートは位置の決まったセルしか受け付けない
+            cell = Cell(worksheet, row=row, column=column, value=value)
+            if style is not None:
+                cell.style = style
+            cells.append(cell)
+        worksheet.append(cells)
+        self._last_rows[worksheet] = row
+    
+    def write_merged(self, worksheet, cell_range: str, value: Any, style: str, height: Optional[float] = None):
+        """
+        cell_range の行を書き込んで結合する。値とスタイルは先頭（左上）のセルに入り、
+        範囲の外周のセルには先頭セルの罫線が付く（openpyxl の merge_cells と同じ）。
+        """
+        merged = CellRange(cell_range)
+        start = Cell(worksheet, row=merged.min_row, column=merged.min_col, value=value)
+        start.style = style
+        
+        if not self.streaming:
+            self.write_row(worksheet, merged.min_row, [None] * (merged.min_col - 1) + [start], height=height)
+            for row in range(merged.min_row + 1, merged.max_row + 1):
+                self.write_row(worksheet, row, [], height=height)
+            worksheet.merge_cells(cell_range)
+            return
+            
+        # 書き込み専用シートは書き込んだ行を後から変更できないため、外周のセルを先に作ってから行を書く
+        worksheet._cells[(merged.min_row, merged.min_col)] = start
+        MergedCellRange(worksheet, cell_range).format()
+        worksheet.merged_cells.add(cell_range)
+        for row in range(merged.min_row, merged.max_row + 1):
+            cells = []
+            for column in range(1, merged.max_col + 1):
+                cell = worksheet._cells.pop((row, column), None)
+                if cell is not None and cell is not start:
+                    # 罫線のない結合セルは書かない。罫線のあるものは値のないセルとして書く
+                    cell = Cell(worksheet, row, column, style_array=copy(cell._style)) if cell.has_style else None
+                cells.append(cell)
+            self.write_row(worksheet, row, cells, height=height)
+    
+    def finish_sheet(self, worksheet):
+        """シートの書き込みを終える（ストリーミングではシートを閉じ、書き出した行をメモリから解放）"""
+        self._last_rows.pop(worksheet, None)
+        if self.streaming:
+            worksheet.close()
+            # 書き出し済みの行・列の設定、結合範囲、データ検証は保存時に使わないので解放する
+            worksheet.row_dimensions.clear()
+            worksheet.column_dimensions.clear()
+            worksheet.merged_cells = MultiCellRange()
+            worksheet.data_validations = DataValidationList()
+    
     def setup_worksheet_layout(self, worksheet, student_name: str, year: int, month: int):
         """ワークシートのレイアウトを設定（A4横向き）"""
         # ページ設定
         worksheet.page_setup.orientation = 'landscape'  # 横向き
-        worksheet.page_setup.paperSize = worksheet.PAPERSIZE_A4
+        worksheet.page_setup.paperSize = Worksheet.PAPERSIZE_A4
         worksheet.page_setup.fitToPage = True
         worksheet.page_setup.fitToHeight = 1
         worksheet.page_setup.fitToWidth = 1
@@ -58,37 +329,13 @@ class ExcelReportGenerator:
     
     def add_title_and_header(self, worksheet, year: int, month: int, student_name: str):
         """レポートタイトル、ロゴ、生徒氏名を追加（テンプレート形式完全準拠）"""
-        # タイトルを1行目中央に配置（テンプレート形式完全準拠）
+        # タイトルを1行目中央に配置し、A1からI1までマージ（テンプレート形式完全準拠、行の高さもテンプレート準拠）
         title = f"{month}月の出席レポート"
-        worksheet['A1'] = title
-        
-        # タイトルスタイル（テンプレート完全準拠）
-        title_font = Font(name='UD デジタル 教科書体 NK', size=24, bold=False)
-        title_alignment = Alignment(horizontal='center', vertical='center')
-        worksheet['A1'].font = title_font
-        worksheet['A1'].alignment = title_alignment
-        
-        # タイトル行をマージ（A1からI1まで）
-        worksheet.merge_cells('A1:I1')
-        
-        # タイトル行の高さを調整（テンプレート準拠）
-        worksheet.row_dimensions[1].height = 35.1
+        self.write_merged(worksheet, 'A1:I1', title, STYLE_TITLE, height=35.1)
         
-        # 生徒氏名を2行目右寄せに配置（テンプレート形式完全準拠）
+        # 生徒氏名を2行目右寄せに配置し、A2からI2までマージ（テンプレート形式完全準拠）
         student_text = f"氏名: {student_name}"
-        worksheet['A2'] = student_text
-        
-        # 生徒氏名スタイル（テンプレート完全準拠）
-        student_font = Font(name='UD デジタル 教科書体 NK', size=20, bold=False)
-        student_alignment = Alignment(horizontal='right', vertical='center')
-        worksheet['A2'].font = student_font
-        worksheet['A2'].alignment = student_alignment
-        
-        # 生徒氏名行をマージ（A2からI2まで）
-        worksheet.merge_cells('A2:I2')
-        
-        # 生徒氏名行の高さを調整（テンプレート準拠）
-        worksheet.row_dimensions[2].height = 30.0
+        self.write_merged(worksheet, 'A2:I2', student_text, STYLE_STUDENT, height=30.0)
         
         # ロゴ画像を配置
         self.add_logo(worksheet)
@@ -99,17 +346,11 @@ class ExcelReportGenerator:
     def add_logo(self, worksheet):
         """ロゴ画像を配置（縦横比固定、高さ62%）"""
         try:
-            logo_path = get_image_path("Onedrop_logo/Onedrop_logo_transparent.png")
+            logo_path = get_image_path(LOGO_IMAGE)
             if logo_path.exists():
-                img = Image(str(logo_path))
-                original_width = img.width
-                original_height = img.height
-                new_height = int(original_height * 0.62)
-                aspect_ratio = original_width / original_height
-                new_width = int(new_height * aspect_ratio)
-                img.width = new_width
-                img.height = new_height
-                worksheet.add_image(img, 'A1')
+                # 読み込み・縮小サイズの計算は1回だけ。ファイルには全シート共通の1枚として保存される
+                data, width, height = load_scaled_image(logo_path, LOGO_SCALE)
+                worksheet.add_image(SharedImage(data, width, height, "report_logo"), 'A1')
             else:
                 print(f"Warning: ロゴ画像が見つかりません: {logo_path}")
         except Exception as e:
@@ -129,102 +370,42 @@ class ExcelReportGenerator:
             "個別対応"
         ]
         
-        # ヘッダーの設定（テンプレート完全準拠）
-        header_font = Font(name='メイリオ', size=12, bold=True, color='FFFFFF')
-        header_fill = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
-        header_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        
-        # ヘッダー行は4行目に配置（タイトル、ロゴ、空行の後）
-        for col_num, header in enumerate(headers, 1):
-            cell = worksheet.cell(row=4, column=col_num)
-            cell.value = header
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
-            cell.border = border
-        
-        # ヘッダー行の高さを調整（テンプレート準拠）
-        worksheet.row_dimensions[4].height = 45.0
+        # ヘッダー行は4行目に配置（タイトル、ロゴ、空行の後。スタイル・行の高さはテンプレート準拠）
+        self.write_row(worksheet, 4, headers, STYLE_HEADER, height=45.0)
     
     def add_attendance_data(self, worksheet, daily_records: List[Dict], start_row: int = 5):
         """出席データを表に追加"""
         if not daily_records:
             return start_row
         
-        # データスタイル（文字サイズを大きく）
-        data_font = Font(name='メイリオ', size=11)
-        data_alignment = Alignment(horizontal='center', vertical='center')
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        
         current_row = start_row
         
         for record in daily_records:
             # 出席日
             date_obj = datetime.strptime(record['date'], '%Y-%m-%d')
             date_str = date_obj.strftime('%m/%d (%a)')
-            worksheet.cell(row=current_row, column=1).value = date_str
             
-            # 利用時間
+            # 利用時間、合計（滞在時間）
             time_range = f"{record['entry_time']}ー{record['exit_time']}"
-            worksheet.cell(row=current_row, column=2).value = time_range
-            
-            # 合計（滞在時間）
             stay_time = f"{record['stay_minutes']}分"
-            worksheet.cell(row=current_row, column=3).value = stay_time
-            
-            # 気分
-            mood = record.get('mood', '')
-            worksheet.cell(row=current_row, column=4).value = mood
-            
-            # 睡眠
-            sleep = record.get('sleep_satisfaction', '')
-            worksheet.cell(row=current_row, column=5).value = sleep
-            
-            # 目的
-            purpose = record.get('purpose', '')
-            worksheet.cell(row=current_row, column=6).value = purpose
-            
-            # プランニング、カウンセリング、個別対応は空欄（後で手動入力）
-            worksheet.cell(row=current_row, column=7).value = ''
-            worksheet.cell(row=current_row, column=8).value = ''
-            worksheet.cell(row=current_row, column=9).value = ''
             
-            # スタイル適用
-            for col in range(1, 10):
-                cell = worksheet.cell(row=current_row, column=col)
-                cell.font = data_font
-                cell.alignment = data_alignment
-                cell.border = border
-            
-            # 行の高さを1ページに収まるよう調整
-            worksheet.row_dimensions[current_row].height = 25
+            # 気分、睡眠、目的。プランニング、カウンセリング、個別対応は空欄（後で手動入力）
+            values = [date_str, time_range, stay_time, record.get('mood', ''),
+                      record.get('sleep_satisfaction', ''), record.get('purpose', ''), '', '', '']
+                      
+            # 1行まとめて書き込む（行の高さは1ページに収まるよう調整）
+            self.write_row(worksheet, current_row, values, STYLE_DATA, height=25)
             
             current_row += 1
-        
+            
         return current_row
     
     def add_summary(self, worksheet, attendance_count: int, start_row: int):
         """利用日数の報告を追加（テンプレート形式に準拠）"""
         summary_text = f"計{attendance_count}日利用"
-        worksheet.cell(row=start_row + 1, column=1).value = summary_text
         
-        # サマリースタイル（文字サイズを大きく）
-        summary_font = Font(name='メイリオ', size=13, bold=True)
-        worksheet.cell(row=start_row + 1, column=1).font = summary_font
-        
-        # サマリー行の高さを1ページに収まるよう調整
-        worksheet.row_dimensions[start_row + 1].height = 25
+        # サマリー（文字サイズを大きく、行の高さは1ページに収まるよう調整）
+        self.write_row(worksheet, start_row + 1, [summary_text], STYLE_HEADING, height=25)
         
         return start_row + 3  # 空行を1行追加
     
@@ -232,40 +413,18 @@ class ExcelReportGenerator:
         """コメント欄を追加（テンプレート形式に準拠）"""
         # コメント欄タイトル（テンプレート形式に準拠）
         comment_title = "様子のコメント："
-        worksheet.cell(row=start_row, column=1).value = comment_title
-        
-        # コメントタイトルスタイル
-        comment_font = Font(name='メイリオ', size=13, bold=True)
-        worksheet.cell(row=start_row, column=1).font = comment_font
         
-        # タイトル行の高さを調整
-        worksheet.row_dimensions[start_row].height = 25
+        # コメントタイトル（タイトル行の高さも調整）
+        self.write_row(worksheet, start_row, [comment_title], STYLE_HEADING, height=25)
         
         # コメント入力エリア（テンプレート形式では空行で表現）
         comment_start_row = start_row + 1
         comment_rows = 3
         
-        # 3行分のセルを全て結合してテキストボックスを作成
-        worksheet.merge_cells(f'A{comment_start_row}:I{comment_start_row + comment_rows - 1}')
-        
-        # 結合されたセルを取得
-        merged_cell = worksheet.cell(row=comment_start_row, column=1)
-        merged_cell.value = ''  # 空欄
-        
-        # コメント欄のスタイル（テンプレート形式に準拠）
-        comment_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        merged_cell.border = comment_border
-        merged_cell.alignment = Alignment(horizontal='left', vertical='top', wrap_text=True)
-        merged_cell.font = Font(name='メイリオ', size=11)
-        
-        # 各行の高さを調整（1ページに収まるよう）
-        for i in range(comment_rows):
-            worksheet.row_dimensions[comment_start_row + i].height = 20
+        # 3行分のセルを全て結合してテキストボックスを作成（先頭は空欄、スタイルはテンプレート形式に準拠）
+        # 各行の高さは1ページに収まるよう調整
+        self.write_merged(worksheet, f'A{comment_start_row}:I{comment_start_row + comment_rows - 1}', '',
+                          STYLE_COMMENT, height=20)
         
         return comment_start_row + comment_rows
     
@@ -289,19 +448,25 @@ class ExcelReportGenerator:
         # G列: プランニング、H列: カウンセリング、I列: 個別対応
         target_columns = ['G', 'H', 'I']
         
-        # 各列の出席データ行（5行目から）にデータ検証を適用
-        for col in target_columns:
-            for row in range(5, 5 + record_count):
-                cell_range = f"{col}{row}"
-                data_validation.add(cell_range)
-        
-        # ワークシートにデータ検証を追加
-        worksheet.add_data_validation(data_validation)
+        # 各列の出席データ行（5行目から）にデータ検証を適用。セルを1つずつ並べず、範囲（G5:I20 など）にまとめる
+        target_cells = [(row, column_index_from_string(col))
+                        for col in target_columns for row in range(5, 5 + record_count)]
+        cell_ranges = compile_ranges(target_cells)
+        if not cell_ranges:
+            return
+        for cell_range in cell_ranges:
+            data_validation.add(cell_range)
+            
+        # ワークシートにデータ検証を追加（書き込み専用シートには add_data_validation がない）
+        worksheet.data_validations.append(data_validation)
     
-    def create_student_sheet(self, student_id: str, year: int, month: int) -> str:
-        """生徒個人のシートを作成"""
+    def create_student_sheet(self, student_id: str, year: int, month: int,
+                             attendance_data: Optional[Dict] = None) -> str:
+        """生徒個人のシートを作成（attendance_data があれば履歴を読み直さない）"""
         # 出席データを取得
-        attendance_data = get_monthly_attendance_data(student_id, year, month)
+        if attendance_data is None:
+            from attendance_app.report_system.data_analyzer import get_monthly_attendance_data
+            attendance_data = get_monthly_attendance_data(student_id, year, month)
         student_name = attendance_data["student_name"]
         daily_records = attendance_data["daily_records"]
         attendance_count = attendance_data["attendance_count"]
@@ -312,29 +477,55 @@ class ExcelReportGenerator:
         safe_sheet_name = "".join(c for c in sheet_name if c.isalnum() or c in (' ', '-', '_'))[:31]
         worksheet = self.workbook.create_sheet(title=safe_sheet_name)
         
-        # レイアウト設定
-        self.setup_worksheet_layout(worksheet, student_name, year, month)
-        
-        # タイトル、ロゴ、生徒氏名追加
-        self.add_title_and_header(worksheet, year, month, student_name)
-        
-        # 表ヘッダー追加
-        self.add_table_headers(worksheet)
-        
-        # 出席データ追加
-        next_row = self.add_attendance_data(worksheet, daily_records)
-        
-        # プルダウン設定を追加（プランニング、カウンセリング、個別対応列）
-        self.add_dropdown_validation(worksheet, len(daily_records))
-        
-        # サマリー追加（テンプレート形式に準拠）
-        next_row = self.add_summary(worksheet, attendance_count, next_row)
-        
-        # コメント欄追加（テンプレート形式に準拠）
-        self.add_comment_section(worksheet, next_row)
-        
+        try:
+            # レイアウト設定
+            self.setup_worksheet_layout(worksheet, student_name, year, month)
+            
+            # タイトル、ロゴ、生徒氏名追加
+            self.add_title_and_header(worksheet, year, month, student_name)
+            
+            # 表ヘッダー追加
+            self.add_table_headers(worksheet)
+            
+            # 出席データ追加
+            next_row = self.add_attendance_data(worksheet, daily_records)
+            
+            # プルダウン設定を追加（プランニング、カウンセリング、個別対応列）
+            self.add_dropdown_validation(worksheet, len(daily_records))
+            
+            # サマリー追加（テンプレート形式に準拠）
+            next_row = self.add_summary(worksheet, attendance_count, next_row)
+            
+            # コメント欄追加（テンプレート形式に準拠）
+            self.add_comment_section(worksheet, next_row)
+            
+            self.finish_sheet(worksheet)
+        except Exception:
+            # 書きかけのシートは壊れたXMLになりうるため、ストリーミングでは一時ファイルを閉じて取り除く
+            self._last_rows.pop(worksheet, None)
+            if self.streaming:
+                self.workbook.remove(worksheet)
+                try:
+                    worksheet.close()
+                except Exception:
+                    pass
+            raise
+            
         return safe_sheet_name
     
+    def _workers_for(self, student_count: int) -> int:
+        """生徒数に見合うワーカー数（1 なら逐次生成）"""
+        return max(1, min(report_worker_count(self.workers), student_count // MIN_STUDENTS_PER_WORKER))
+    
+    def load_month(self, year: int, month: int) -> List[Tuple[str, Dict]]:
+        """対象月に出席記録がある生徒の (生徒ID, 集計済みデータ) の一覧"""
+        from attendance_app.report_system.data_analyzer import MonthlyAttendanceFrame
+        
+        # 対象月の出席履歴を1回だけ読み込み、生徒ごとに分割・集計
+        month_frame = MonthlyAttendanceFrame(year, month)
+        return [(student["id"], month_frame.get_student_data(student["id"]))
+                for student in month_frame.students_with_attendance()]
+    
     def generate_monthly_reports(self, year: int, month: int) -> str:
         """指定月の全生徒のレポートを1つのExcelファイルに生成"""
         try:
@@ -342,19 +533,23 @@ class ExcelReportGenerator:
             self.create_workbook()
             
             # 対象月に出席記録がある生徒を取得
-            students = get_students_with_attendance(year, month)
+            students = self.load_month(year, month)
             
             if not students:
                 return ""
-            
+                
             generated_sheets = []
-            
-            # 生徒ごとにシートを作成
-            for student in students:
+            # 1つのファイルにまとめるので逐次生成する（ワーカーで描画したシートを受け取って
+            # 結合・保存する親プロセスの処理だけで逐次生成とほぼ同じ時間がかかるため）
+            for student_id, attendance_data in students:
                 try:
-                    sheet_name = self.create_student_sheet(student["id"], year, month)
+                    sheet_name = self.create_student_sheet(
+                        student_id, year, month, attendance_data=attendance_data
+                    )
                     generated_sheets.append(sheet_name)
                 except Exception as e:
+                    logger.error(f"Skipping report sheet for student {student_id} ({year}-{month:02d}): {e}",
+                                 exc_info=True)
                     continue
             
             # ファイル名生成
@@ -363,7 +558,7 @@ class ExcelReportGenerator:
             output_path = self.output_dir / filename
             
             # Excelファイル保存
-            self.workbook.save(str(output_path))
+            save_report_workbook(self.workbook, str(output_path))
             
             return str(output_path)
             
@@ -371,19 +566,22 @@ class ExcelReportGenerator:
             print(f"Excel レポート生成中にエラーが発生しました: {e}")
             raise
     
-    def generate_single_student_report(self, student_id: str, year: int, month: int) -> str:
-        """単一生徒のExcelレポートを生成"""
+    def generate_single_student_report(self, student_id: str, year: int, month: int,
+                                       attendance_data: Optional[Dict] = None) -> str:
+        """単一生徒のExcelレポートを生成（attendance_data があれば履歴を読み直さない）"""
         try:
             # ワークブック作成
             self.create_workbook()
             
-            # 生徒のシートを作成
-            sheet_name = self.create_student_sheet(student_id, year, month)
-            
-            # 出席データを取得（生徒名取得のため）
-            attendance_data = get_monthly_attendance_data(student_id, year, month)
+            # 出席データを取得（シート作成と生徒名取得で共用）
+            if attendance_data is None:
+                from attendance_app.report_system.data_analyzer import get_monthly_attendance_data
+                attendance_data = get_monthly_attendance_data(student_id, year, month)
             student_name = attendance_data["student_name"]
             
+            # 生徒のシートを作成
+            sheet_name = self.create_student_sheet(student_id, year, month, attendance_data=attendance_data)
+            
             # ファイル名生成
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             safe_student_name = "".join(c for c in student_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
@@ -391,21 +589,39 @@ class ExcelReportGenerator:
             output_path = self.output_dir / filename
             
             # Excelファイル保存
-            self.workbook.save(str(output_path))
+            save_report_workbook(self.workbook, str(output_path))
             
             return str(output_path)
             
         except Exception as e:
             print(f"個人Excel レポート生成中にエラーが発生しました: {e}")
             raise
+    
+    def generate_individual_reports(self, year: int, month: int) -> List[str]:
+        """指定月の全生徒の個人レポート（生徒ごとのExcelファイル）を生成し、ファイルパスの一覧を返す"""
+        students = self.load_month(year, month)
+        workers = self._workers_for(len(students))
+        if workers > 1:
+            # 1人1ファイルなので結合は不要。ワーカーがそれぞれ保存する
+            with _process_pool(workers) as executor:
+                return list(executor.map(_save_student_report, repeat(year), repeat(month), students,
+                                         chunksize=math.ceil(len(students) / (workers * 4))))
+        return [self.generate_single_student_report(student_id, year, month, attendance_data=attendance_data)
+                for student_id, attendance_data in students]
 
 
-def generate_excel_reports(year: int, month: int) -> str:
+def generate_excel_reports(year: int, month: int, streaming: Optional[bool] = None) -> str:
     """Excel形式の月次レポートを生成（メイン関数）"""
-    generator = ExcelReportGenerator()
+    generator = ExcelReportGenerator(streaming=streaming)
     return generator.generate_monthly_reports(year, month)
 
 
+def generate_individual_excel_reports(year: int, month: int, workers: Optional[int] = None) -> List[str]:
+    """指定月の全生徒の個人Excelレポートを生徒ごとのファイルに生成"""
+    generator = ExcelReportGenerator(workers)
+    return generator.generate_individual_reports(year, month)
+
+
 def generate_single_excel_report(student_id: str, year: int, month: int) -> str:
     """単一生徒のExcel形式レポートを生成"""
     generator = ExcelReportGenerator()
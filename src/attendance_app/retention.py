@@ -0,0 +1,70 @@
+"""
+Data retention for Attendance Management System v3.4
+Keeps the kiosk database from growing without bound: records whose entry is older
+than RETENTION_DAYS are archived to monthly gzip files (output/archive/YYYY-MM.csv.gz),
+deleted from the database in short chunks, and the freed pages are returned to
+the file system with incremental vacuum. History partitions keep the archived
+records, so reports over old months are unaffected.
+Only records that have left the kiosk are deleted: uploaded ones if a sync target
+is configured, otherwise ones already synced to the Excel workbook.
+"""
+
+import logging
+from typing import Optional
+
+from attendance_app.history_partitions import archive_history_rows, history_partitions
+from attendance_app.offline_storage import OfflineStorage, offline_storage
+from attendance_app.settings import settings_manager
+from attendance_app.spreadsheet import excel_synced_revision
+
+logger = logging.getLogger(__name__)
+
+# Seconds between retention runs of a long-running kiosk
+RETENTION_INTERVAL = 24 * 60 * 60
+
+
+def sync_configured() -> bool:
+    """True if a background sync target is configured (records must be uploaded before deletion)."""
+    settings = settings_manager.settings
+    target = (settings.sync_target or "").strip().lower()
+    if target:
+        return target != "none"
+    return bool(settings.sync_hub_url)
+
+
+def run_retention(storage: OfflineStorage = offline_storage, days: Optional[int] = None) -> int:
+    """
+    Archive and delete records older than the retention period, then vacuum.
+    Returns the number of records deleted (0 if retention is disabled or failed).
+    """
+    settings = settings_manager.settings
+    days = settings.retention_days if days is None else days
+    if days <= 0:
+        return 0
+
+    try:
+        # Bring the partitions up to date first, so the deleted records are already materialized
+        if storage is offline_storage:
+            history_partitions.refresh()
+
+        # Without a sync target nothing marks records as uploaded; keep those not yet in the workbook
+        synced_only = sync_configured()
+        max_revision = None
+        if not synced_only:
+            max_revision = excel_synced_revision() if storage is offline_storage else 0
+            if max_revision > storage.current_revision():
+                max_revision = 0  # the sync state belongs to another database
+        deleted = storage.cleanup_old_records(
+            days=days,
+            chunk_size=settings.retention_chunk_size,
+            synced_only=synced_only,
+            archive=archive_history_rows if settings.retention_archive else None,
+            max_revision=max_revision,
+        )
+        if deleted:
+            storage.vacuum()
+        return deleted
+
+    except Exception as e:
+        logger.error(f"Retention run failed: {e}")
+        return 0
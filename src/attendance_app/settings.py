@@ -31,6 +31,38 @@ class AppSettings(BaseSettings):
     # Database Configuration
     database_url: str = Field("sqlite:///attendance.db", env="DATABASE_URL")
     
+    # Attendance Store (group commit of kiosk writes)
+    write_batch_interval_ms: int = Field(10, env="WRITE_BATCH_INTERVAL_MS")
+    write_batch_max_events: int = Field(64, env="WRITE_BATCH_MAX_EVENTS")
+    write_queue_size: int = Field(1000, env="WRITE_QUEUE_SIZE")
+    
+    # Multi-kiosk Sync Hub (optional; shares every kiosk's records and backs them up; leave SYNC_HUB_URL empty for a standalone kiosk)
+    sync_hub_url: Optional[str] = Field(None, env="SYNC_HUB_URL")
+    # Shared secret sent by every kiosk and checked by the hub on every request
+    sync_hub_token: Optional[str] = Field(None, env="SYNC_HUB_TOKEN")
+    kiosk_id: str = Field(platform.node() or "kiosk", env="KIOSK_ID")
+    
+    # Background Sync Worker (SYNC_TARGET: http / sqlite / excel / none; default http if SYNC_HUB_URL is set)
+    sync_target: Optional[str] = Field(None, env="SYNC_TARGET")
+    sync_sqlite_path: Optional[str] = Field(None, env="SYNC_SQLITE_PATH")
+    sync_batch_size: int = Field(200, env="SYNC_BATCH_SIZE")
+    sync_interval_seconds: float = Field(5.0, env="SYNC_INTERVAL_SECONDS")
+    sync_max_backoff_seconds: float = Field(300.0, env="SYNC_MAX_BACKOFF_SECONDS")
+    
+    # History Storage (monthly partitions older than this many months are gzip-compressed)
+    history_compress_after_months: int = Field(3, env="HISTORY_COMPRESS_AFTER_MONTHS")
+    
+    # Reports (worker processes for per-student Excel report files; 0 = one per CPU core, 1 = no worker processes)
+    report_workers: int = Field(0, env="REPORT_WORKERS")
+    # Write report sheets straight to disk one at a time (write-only workbook) to keep memory flat
+    report_streaming: bool = Field(False, env="REPORT_STREAMING")
+    
+    # Retention (records older than this many days are archived and removed from the database once they
+    # have been uploaded, or synced to the Excel workbook if there is no sync target; 0 = keep forever)
+    retention_days: int = Field(365, env="RETENTION_DAYS")
+    retention_archive: bool = Field(True, env="RETENTION_ARCHIVE")
+    retention_chunk_size: int = Field(500, env="RETENTION_CHUNK_SIZE")
+    
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -191,6 +223,22 @@ class SettingsManager:
         path.mkdir(parents=True, exist_ok=True)
         return path
     
+    def get_database_path(self) -> Path:
+        """Get SQLite database path from DATABASE_URL (sqlite:///relative/or/absolute/path.db)."""
+        url = self.settings.database_url
+        prefix = "sqlite:///"
+        if not url.startswith(prefix):
+            logger.warning(f"Unsupported DATABASE_URL '{url}', using attendance_offline.db")
+            return self.base_dir / "attendance_offline.db"
+        path = self.get_absolute_path(url[len(prefix):])
+        # Earlier versions always kept their records in attendance_offline.db; keep using it
+        # until a database exists at the configured path
+        legacy_path = self.base_dir / "attendance_offline.db"
+        if not path.exists() and legacy_path.exists():
+            logger.info(f"Using existing database {legacy_path} (DATABASE_URL points to {path}, which does not exist)")
+            return legacy_path
+        return path
+    
     def get_qr_code_directory(self) -> Path:
         """Get QR code directory path."""
         folder = self.settings.qr_code_folder
@@ -258,6 +306,35 @@ DEBUG_MODE={str(self.settings.debug_mode).lower()}
 
 # Database Configuration (for offline support)
 DATABASE_URL={self.settings.database_url}
+
+# Attendance Store (group commit of kiosk writes)
+WRITE_BATCH_INTERVAL_MS={self.settings.write_batch_interval_ms}
+WRITE_BATCH_MAX_EVENTS={self.settings.write_batch_max_events}
+WRITE_QUEUE_SIZE={self.settings.write_queue_size}
+
+# Multi-kiosk Sync Hub, shared history of all kiosks (e.g. http://192.168.0.10:8765; empty = standalone)
+SYNC_HUB_URL={self.settings.sync_hub_url or ''}
+SYNC_HUB_TOKEN=
+KIOSK_ID={self.settings.kiosk_id}
+
+# Background Sync Worker (http / sqlite / excel / none)
+SYNC_TARGET={self.settings.sync_target or ''}
+SYNC_SQLITE_PATH={self.settings.sync_sqlite_path or ''}
+SYNC_BATCH_SIZE={self.settings.sync_batch_size}
+SYNC_INTERVAL_SECONDS={self.settings.sync_interval_seconds}
+SYNC_MAX_BACKOFF_SECONDS={self.settings.sync_max_backoff_seconds}
+
+# History Storage
+HISTORY_COMPRESS_AFTER_MONTHS={self.settings.history_compress_after_months}
+
+# Reports (worker processes for per-student files; 0 = CPU core count)
+REPORT_WORKERS={self.settings.report_workers}
+REPORT_STREAMING={str(self.settings.report_streaming).lower()}
+
+# Retention (days; 0 = keep forever)
+RETENTION_DAYS={self.settings.retention_days}
+RETENTION_ARCHIVE={str(self.settings.retention_archive).lower()}
+RETENTION_CHUNK_SIZE={self.settings.retention_chunk_size}
 """
         env_path.write_text(content, encoding='utf-8')
         logger.info(f"Created example environment file: {env_path}")
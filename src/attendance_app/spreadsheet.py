@@ -1,108 +1,60 @@
 """
 Local CSV data handling for Attendance Management System v3.4
 This module replaces the Google Sheets integration with local CSV file operations,
-including persistent storage for attendance records.
+including persistent storage for attendance records. Kiosk reads and writes go to
+the SQLite attendance store; attendance_history.csv is exported from it on demand.
 """
 
-import csv
+import json
 import logging
+from concurrent.futures import Future
 from datetime import datetime
-from functools import lru_cache
 from typing import Dict, List, Optional, Tuple
 
-import pandas as pd
 from openpyxl import load_workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
 from attendance_app.path_manager import get_asset_path, get_output_dir
+from attendance_app.history_format import (
+    HISTORY_COLUMNS, HISTORY_FILE, LEGACY_COLUMN_ALIASES, TIMESTAMP_FIELDS, TIMESTAMP_FORMAT, normalize_timestamp,
+)
+from attendance_app.file_lock import atomic_path, atomic_write, file_lock
+from attendance_app.offline_storage import offline_storage
+from attendance_app.student_roster import RosterError, student_roster
 
 logger = logging.getLogger(__name__)
 
-# Define the path for the persistent attendance history CSV
-ATTENDANCE_HISTORY_FILE = get_output_dir() / "attendance_history.csv"
+# Define the path for the legacy attendance history CSV (exported from the SQLite store)
+ATTENDANCE_HISTORY_FILE = HISTORY_FILE
+
+# Excel同期の進捗（同期済みのリビジョンと、未完了行のExcel行番号）
+EXCEL_SYNC_STATE_FILE = get_output_dir() / "excel_sync_state.json"
+ATTENDANCE_SHEET = 'Attendance_Information'
 
 class CsvDataError(Exception):
     """Custom exception for CSV data handling errors."""
     pass
 
-def _initialize_attendance_history():
-    """Ensures the attendance history CSV file exists with the correct header."""
-    if not ATTENDANCE_HISTORY_FILE.exists():
-        ATTENDANCE_HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
-        with open(ATTENDANCE_HISTORY_FILE, 'w', newline='', encoding='utf-8-sig') as f:
-            writer = csv.writer(f)
-            writer.writerow(["Entry_Time", "StudentID", "Name", "Mood", "Sleep_Satisfaction", "Purpose", "Exit_Time"])
-
-# Initialize the history file on module load
-_initialize_attendance_history()
-
-@lru_cache()
 def _read_student_data_from_excel() -> List[Dict[str, str]]:
     """Reads student data from the local Sample_Data.xlsx file (StudentID_StudentName sheet)."""
-    # Try xlsx first, then fall back to xlsm
-    excel_file_path = get_asset_path('Sample_Data.xlsx')
-    if not excel_file_path.exists():
-        excel_file_path = get_asset_path('Sample_Data.xlsm')
-    if not excel_file_path.exists():
-        raise CsvDataError(f"Student data file not found: {excel_file_path}")
-
-    student_list = []
     try:
-        # openpyxl を使用してExcelファイルを読み込む
-        from openpyxl import load_workbook
-        workbook = load_workbook(excel_file_path, data_only=True)
-        sheet = workbook['StudentID_StudentName'] # StudentID_StudentName シートを指定
-
-        # ヘッダー行をスキップし、データを読み込む
-        headers = [cell.value for cell in sheet[1]] # 1行目をヘッダーとして取得
-        
-        # StudentIDとStudentNameの列インデックスを特定
-        student_id_col_idx = -1
-        student_name_col_idx = -1
-        for i, header in enumerate(headers):
-            if header == 'StudentID':
-                student_id_col_idx = i
-            elif header == 'StudentName':
-                student_name_col_idx = i
-
-        if student_id_col_idx == -1 or student_name_col_idx == -1:
-            raise CsvDataError("Required headers 'StudentID' or 'StudentName' not found in StudentID_StudentName sheet.")
-
-        for row_idx in range(2, sheet.max_row + 1): # 2行目からデータを読み込む
-            row_data = [cell.value for cell in sheet[row_idx]]
-            if len(row_data) > max(student_id_col_idx, student_name_col_idx):
-                student_id = str(row_data[student_id_col_idx]).strip()
-                student_name = str(row_data[student_name_col_idx]).strip()
-                student_list.append({"id": student_id, "name": student_name})
-    except ImportError:
-        raise CsvDataError("openpyxl library not found. Please install it: pip install openpyxl")
-    except KeyError:
-        raise CsvDataError("Sheet 'StudentID_StudentName' not found in Sample_Data.xlsm. Please check the sheet name.")
-    except Exception as e:
-        raise CsvDataError(f"Failed to process student data Excel: {e}")
-    return student_list
+        return student_roster.all_students()
+    except RosterError as e:
+        raise CsvDataError(str(e))
 
 def get_student_name(student_id: str) -> str:
-    """Get student name by ID from the local Excel data."""
+    """Get student name by ID from the in-memory student roster."""
     try:
-        all_students = _read_student_data_from_excel()
-        for student in all_students:
-            if student["id"] == str(student_id):
-                return student["name"]
-        return "Unknown"
-    except CsvDataError:
+        name = student_roster.get_name(str(student_id))
+        return name if name is not None else "Unknown"
+    except RosterError:
         return "Unknown"
 
 def get_last_record(student_id: str) -> Tuple[Optional[int], Optional[str]]:
-    """Gets the last record for a student from the CSV file."""
+    """Gets the open record ID for a student with an indexed lookup in the attendance store."""
     try:
-        df = pd.read_csv(ATTENDANCE_HISTORY_FILE, dtype=str, encoding='utf-8-sig')
-        student_records = df[df['StudentID'] == str(student_id)]
-        
-        if not student_records.empty:
-            last_record = student_records.iloc[-1]
-            # If ExitTime is missing or empty, the student is considered "in"
-            if pd.isna(last_record.get('Exit_Time')) or not last_record.get('Exit_Time'):
-                return int(last_record.name) + 2, None  # Return DataFrame index + 2 to mimic 1-based gspread row
+        # If the latest record has no Exit_Time, the student is considered "in"
+        session = offline_storage.get_open_session(str(student_id))
+        if session is not None:
+            return session[0], None
         return None, "dummy_exit_time" # No open entry found
     except FileNotFoundError:
         return None, None
@@ -111,61 +63,68 @@ def get_last_record(student_id: str) -> Tuple[Optional[int], Optional[str]]:
         return None, None
 
 def append_entry(student_id: str, student_name: str) -> Optional[int]:
-    """Appends a new entry to the attendance history CSV."""
+    """Inserts a new attendance record into the attendance store and returns its stable record ID."""
     try:
-        # Read current data to get the number of existing rows
-        try:
-            df_before_append = pd.read_csv(ATTENDANCE_HISTORY_FILE, dtype=str, encoding='utf-8-sig')
-            num_existing_data_rows = len(df_before_append)
-        except FileNotFoundError:
-            num_existing_data_rows = 0 # File doesn't exist yet, so 0 data rows
-
-        entry_time = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
-        new_record = [entry_time, student_id, student_name, "", "", "", ""]
-        
-        with open(ATTENDANCE_HISTORY_FILE, 'a', newline='', encoding='utf-8-sig') as f:
-            writer = csv.writer(f)
-            writer.writerow(new_record)
-        
-        # The new row's 1-based index in the CSV file (including header)
-        # If 0 existing data rows, new row is 1st data row, which is line 2. (0 + 2)
-        # If 1 existing data row, new row is 2nd data row, which is line 3. (1 + 2)
-        return num_existing_data_rows + 2
+        entry_time = datetime.now().strftime(TIMESTAMP_FORMAT)
+        return offline_storage.save_attendance_record(student_id, student_name, entry_time)
     except Exception as e:
         logger.error(f"Failed to append entry: {e}")
         return None
 
-def write_response(row: int, col: int, value: str) -> bool:
-    """Writes a response (mood, sleep, etc.) to the specified row in the CSV."""
+def _resolved(result: bool) -> "Future[bool]":
+    future: "Future[bool]" = Future()
+    future.set_result(result)
+    return future
+
+def _confirmed(write: Future, description: str) -> "Future[bool]":
+    """Maps a store write future to True/False, logging failures like the blocking API does."""
+    confirmed: "Future[bool]" = Future()
+
+    def done(f: Future) -> None:
+        try:
+            ok = bool(f.result())
+            if not ok:
+                logger.warning(f"{description}: no such attendance record")
+        except Exception as e:
+            logger.error(f"Failed to {description}: {e}")
+            ok = False
+        confirmed.set_result(ok)
+
+    write.add_done_callback(done)
+    return confirmed
+
+def write_response_async(record_id: int, col: int, value: str) -> "Future[bool]":
+    """
+    Queues a response (mood, sleep, etc.) for the specified record without waiting for the disk.
+    The returned future resolves to True once the write is committed, or False if it failed.
+    """
     try:
-        df = pd.read_csv(ATTENDANCE_HISTORY_FILE, dtype=str, encoding='utf-8-sig')
-        # Convert 1-based Kivy row to 0-based DataFrame index
-        df_index = row - 2
-        
-        logger.debug(f"write_response: row={row}, col={col}, value='{value}'")
-        logger.debug(f"write_response: df_index={df_index}")
-
-        if 0 <= df_index < len(df):
-            col_name = df.columns[col - 1] # Convert 1-based col to 0-based col index
-            logger.debug(f"write_response: col_name='{col_name}'")
-            df.loc[df_index, col_name] = value
-            df.to_csv(ATTENDANCE_HISTORY_FILE, index=False, encoding='utf-8-sig')
-            logger.debug(f"write_response: Successfully wrote to {ATTENDANCE_HISTORY_FILE}")
-            return True
-        logger.warning(f"write_response: Invalid df_index {df_index} for DataFrame of length {len(df)}")
-        return False
+        logger.debug(f"write_response: record={record_id}, col={col}, value='{value}'")
+        if not 1 <= col <= len(HISTORY_COLUMNS):
+            logger.warning(f"write_response: Invalid column {col}")
+            return _resolved(False)
+
+        col_name = HISTORY_COLUMNS[col - 1] # Convert 1-based col to column name
+        if col_name in TIMESTAMP_FIELDS:
+            value = normalize_timestamp(value)
+        write = offline_storage.submit_record_field(record_id, col_name, value)
+        return _confirmed(write, f"write {col_name} for record {record_id}")
     except Exception as e:
         logger.error(f"Failed to write response: {e}")
-        return False
+        return _resolved(False)
 
-def write_exit(row: int) -> bool:
-    """Writes the exit time to the specified row in the CSV."""
-    try:
-        exit_time = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
-        return write_response(row, 7, exit_time) # Column G (Exit_Time) is the 7th column
-    except Exception as e:
-        logger.error(f"Failed to write exit time: {e}")
-        return False
+def write_response(record_id: int, col: int, value: str) -> bool:
+    """Writes a response (mood, sleep, etc.) for the specified record to the attendance store."""
+    return write_response_async(record_id, col, value).result()
+
+def write_exit_async(record_id: int) -> "Future[bool]":
+    """Queues the exit time for the specified record; see write_response_async."""
+    exit_time = datetime.now().strftime(TIMESTAMP_FORMAT)
+    return write_response_async(record_id, 7, exit_time) # Column G (Exit_Time) is the 7th column
+
+def write_exit(record_id: int) -> bool:
+    """Writes the exit time for the specified record."""
+    return write_exit_async(record_id).result()
 
 def get_student_list_for_printing() -> List[Dict[str, str]]:
     """Gets the list of all students from the Excel for printing purposes."""
@@ -175,29 +134,150 @@ def get_student_list_for_printing() -> List[Dict[str, str]]:
         logger.error(f"Could not get student list for printing: {e}")
         return []
 
+def _cell_text(value) -> str:
+    """Excelのセル値をCSVと比較できる文字列に変換する"""
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.strftime(TIMESTAMP_FORMAT)
+    return str(value).strip()
+
+def _load_excel_sync_state() -> Optional[dict]:
+    """前回のExcel同期の状態（ジャーナルの同期済み位置など）を読み込む"""
+    if not EXCEL_SYNC_STATE_FILE.exists():
+        return None
+    try:
+        with open(EXCEL_SYNC_STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Ignoring unreadable Excel sync state: {e}")
+        return None
+
+def _save_excel_sync_state(state: dict) -> None:
+    with atomic_write(EXCEL_SYNC_STATE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+
+def excel_synced_revision() -> int:
+    """Excelに同期済みの出席記録のリビジョン（まだ同期していなければ0）"""
+    state = _load_excel_sync_state()
+    if state is None:
+        return 0
+    try:
+        return int(state.get("revision", 0))
+    except (TypeError, ValueError):
+        return 0
+
+def _get_attendance_sheet(workbook) -> Tuple[object, Dict[str, int]]:
+    """Attendance_Information シートと、列名 -> 列番号(1始まり) の対応を返す"""
+    if ATTENDANCE_SHEET not in workbook.sheetnames:
+        logger.warning(f"Sheet '{ATTENDANCE_SHEET}' not found in Sample_Data.xlsm. Creating new sheet.")
+        sheet = workbook.create_sheet(ATTENDANCE_SHEET)
+        # ヘッダーを書き込む
+        sheet.append(HISTORY_COLUMNS)
+    else:
+        sheet = workbook[ATTENDANCE_SHEET]
+
+    # ExcelのヘッダーがCSVのヘッダーと異なる場合（旧ヘッダー名）にも対応
+    header = [cell.value for cell in sheet[1]]
+    columns = {}
+    for col_idx, name in enumerate(header, start=1):
+        name = LEGACY_COLUMN_ALIASES.get(name, name)
+        if name in HISTORY_COLUMNS and name not in columns:
+            columns[name] = col_idx
+    missing = [name for name in HISTORY_COLUMNS if name not in columns]
+    if missing:
+        raise CsvDataError(f"Sheet '{ATTENDANCE_SHEET}' is missing columns: {missing}")
+    return sheet, columns
+
+def _write_sheet_values(sheet, excel_row: int, columns: Dict[str, int], values: Dict[str, str]) -> bool:
+    """空でない値のうち、セルと異なるものだけを書き込む。書き込みがあればTrue"""
+    changed = False
+    for name, value in values.items():
+        if not value:
+            continue
+        cell = sheet.cell(row=excel_row, column=columns[name])
+        current = _cell_text(cell.value)
+        if name in TIMESTAMP_FIELDS:
+            current = normalize_timestamp(current)
+        if current != value:
+            cell.value = value
+            changed = True
+    return changed
+
+def _full_excel_sync(sheet, columns: Dict[str, int]) -> Tuple[int, Dict[str, list], int, int]:
+    """出席記録全体とシートを突き合わせて同期する（初回・状態不整合時）"""
+    records = offline_storage.get_history_rows()
+
+    # 既存のExcel行を (Entry_Time, StudentID) で索引化
+    entry_col, id_col = columns["Entry_Time"] - 1, columns["StudentID"] - 1
+    existing = {}
+    for excel_row, row_values in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
+        if len(row_values) > max(entry_col, id_col):
+            key = (normalize_timestamp(_cell_text(row_values[entry_col])), _cell_text(row_values[id_col]))
+            existing.setdefault(key, excel_row)
+
+    changed = 0
+    pending = {}
+    revision = last_id = 0
+    for record_id, record_revision, record_values in records:
+        values = dict(zip(HISTORY_COLUMNS, record_values))
+        excel_row = existing.get((normalize_timestamp(values["Entry_Time"]), values["StudentID"]))
+        if excel_row is None:
+            excel_row = sheet.max_row + 1
+            _write_sheet_values(sheet, excel_row, columns, values)
+            changed += 1
+        elif _write_sheet_values(sheet, excel_row, columns, values):
+            changed += 1
+        if not values["Exit_Time"]:
+            pending[str(record_id)] = [excel_row, values["Entry_Time"], values["StudentID"]]
+        revision = max(revision, record_revision)
+        last_id = max(last_id, record_id)
+    return changed, pending, revision, last_id
+
+def _incremental_excel_sync(sheet, columns: Dict[str, int],
+                            state: dict) -> Optional[Tuple[int, Dict[str, list], int, int]]:
+    """前回同期したリビジョン以降に変更された記録だけを反映する。整合しない場合はNoneを返す"""
+    records = offline_storage.get_history_rows(state["revision"])
+    pending = dict(state.get("pending", {}))
+    revision, last_id = state["revision"], state["last_id"]
+    changed = 0
+
+    for record_id, record_revision, record_values in records:
+        values = dict(zip(HISTORY_COLUMNS, record_values))
+        target = pending.get(str(record_id))
+        if target is not None:
+            # 同期済みだが未完了だった行（退出時刻の後追い記録など）を更新
+            excel_row, entry_time, student_id = target
+            if (normalize_timestamp(_cell_text(sheet.cell(row=excel_row, column=columns["Entry_Time"]).value)) != entry_time or
+                    _cell_text(sheet.cell(row=excel_row, column=columns["StudentID"]).value) != student_id):
+                logger.info(f"Excel row {excel_row} no longer matches attendance record {record_id}")
+                return None
+            if _write_sheet_values(sheet, excel_row, columns, values):
+                changed += 1
+            if values["Exit_Time"]:
+                del pending[str(record_id)]
+        elif record_id > last_id:
+            # 新しい行を追記
+            excel_row = sheet.max_row + 1
+            _write_sheet_values(sheet, excel_row, columns, values)
+            changed += 1
+            if not values["Exit_Time"]:
+                pending[str(record_id)] = [excel_row, values["Entry_Time"], values["StudentID"]]
+        else:
+            logger.info(f"Attendance record {record_id} changed after it was synced to Excel")
+            return None
+        revision = max(revision, record_revision)
+        last_id = max(last_id, record_id)
+    return changed, pending, revision, last_id
+
 def sync_attendance_to_excel() -> bool:
     """
-    attendance_history.csv の出席情報を Sample_Data.xlsm の Attendance_Information シートに同期する。
+    出席記録を Sample_Data.xlsm の Attendance_Information シートに同期する。
+    前回同期したリビジョンを記録しておき、それ以降に追加された記録と
+    未完了だった行の更新（退出時刻など）だけを反映する。
     """
     try:
-        # 1. attendance_history.csv を読み込む
-        if not ATTENDANCE_HISTORY_FILE.exists():
-            logger.info("attendance_history.csv does not exist. Nothing to sync.")
-            return True
-
-        df_csv = pd.read_csv(ATTENDANCE_HISTORY_FILE, encoding='utf-8-sig', dtype=str)
-        # CSVのヘッダーをExcelのヘッダーに合わせる
-        df_csv = df_csv.rename(columns={
-            "EntryTime": "Entry_Time", # 既存のCSVがEntryTimeの場合の対応
-            "StudentName": "Name",     # 既存のCSVがStudentNameの場合の対応
-            "Sleep": "Sleep_Satisfaction", # 既存のCSVがSleepの場合の対応
-            "ExitTime": "Exit_Time"    # 既存のCSVがExitTimeの場合の対応
-        })
-        # 必要な列のみを選択し、順序を合わせる
-        required_cols = ["Entry_Time", "StudentID", "Name", "Mood", "Sleep_Satisfaction", "Purpose", "Exit_Time"]
-        df_csv = df_csv[required_cols]
-
-        # 2. Sample_Data.xlsx を読み込む
+        # 1. Sample_Data.xlsx を読み込む
         excel_file_path = get_asset_path('Sample_Data.xlsx')
         if not excel_file_path.exists():
             excel_file_path = get_asset_path('Sample_Data.xlsm')
@@ -205,55 +285,56 @@ def sync_attendance_to_excel() -> bool:
             logger.error(f"Sample_Data file not found: {excel_file_path}")
             return False
 
-        workbook = load_workbook(excel_file_path)
-        sheet_name = 'Attendance_Information'
-        
-        if sheet_name not in workbook.sheetnames:
-            logger.warning(f"Sheet '{sheet_name}' not found in Sample_Data.xlsm. Creating new sheet.")
-            sheet = workbook.create_sheet(sheet_name)
-            # ヘッダーを書き込む
-            sheet.append(required_cols)
-            df_excel = pd.DataFrame(columns=required_cols) # 新規作成時は空のDataFrame
-        else:
-            sheet = workbook[sheet_name]
-            # ExcelのデータをDataFrameに変換
-            data = sheet.values
-            cols = next(data) # ヘッダー行
-            df_excel = pd.DataFrame(data, columns=cols)
-            # ExcelのヘッダーがCSVのヘッダーと異なる場合のリネーム
-            df_excel = df_excel.rename(columns={
-                "EntryTime": "Entry_Time",
-                "StudentName": "Name",
-                "Sleep": "Sleep_Satisfaction",
-                "ExitTime": "Exit_Time"
+        # 生徒登録や他のキオスク・レポート処理と同じブックを読み書きするため、同期中はロックする
+        with file_lock(excel_file_path):
+            # 2. 前回の同期状態を確認し、新しい変更がなければ何もしない
+            state = _load_excel_sync_state()
+            current_revision = offline_storage.current_revision()
+            if (state is None or state.get("workbook") != str(excel_file_path)
+                    or "revision" not in state or state["revision"] > current_revision):
+                state = None
+            elif state["revision"] == current_revision:
+                logger.info("No new entries to sync to Excel.")
+                return True
+
+            workbook = load_workbook(excel_file_path)
+            sheet, columns = _get_attendance_sheet(workbook)
+
+            # 3. 差分をExcelに反映する（状態が使えない場合は全件突き合わせ）
+            result = _incremental_excel_sync(sheet, columns, state) if state else None
+            if result is None:
+                logger.info("Running full attendance sync to Excel.")
+                workbook = load_workbook(excel_file_path)
+                sheet, columns = _get_attendance_sheet(workbook)
+                result = _full_excel_sync(sheet, columns)
+            changed, pending, revision, last_id = result
+
+            if changed:
+                logger.info(f"Found {changed} new or updated entries to sync to Excel.")
+                with atomic_path(excel_file_path) as tmp_path:
+                    workbook.save(tmp_path)
+                logger.info(f"Successfully synced {changed} entries to {excel_file_path}")
+            else:
+                logger.info("No new entries to sync to Excel.")
+
+            _save_excel_sync_state({
+                "workbook": str(excel_file_path),
+                "revision": revision,
+                "last_id": last_id,
+                "pending": pending,
+                "synced_at": datetime.now().isoformat(),
             })
-            # 必要な列のみを選択し、順序を合わせる
-            df_excel = df_excel[required_cols]
-
-
-        # 3. 差分を検出してExcelに追記する
-        # 既存のExcelデータにないCSVの行を特定
-        # 厳密な比較のため、両方のDataFrameを文字列型に変換
-        df_csv_str = df_csv.astype(str)
-        df_excel_str = df_excel.astype(str)
-
-        # Excelに存在しない行を特定
-        # マージして、Excelにのみ存在する行をフィルタリング
-        merged_df = pd.merge(df_csv_str, df_excel_str, on=required_cols, how='left', indicator=True)
-        new_entries = merged_df[merged_df['_merge'] == 'left_only'].drop(columns=['_merge'])
-
-        if not new_entries.empty:
-            logger.info(f"Found {len(new_entries)} new entries to sync to Excel.")
-            # 新しいエントリをExcelシートに追記
-            for r_idx, row_data in enumerate(dataframe_to_rows(new_entries, index=False, header=False)):
-                sheet.append(row_data)
-            workbook.save(excel_file_path)
-            logger.info(f"Successfully synced {len(new_entries)} entries to {excel_file_path}")
-            return True
-        else:
-            logger.info("No new entries to sync to Excel.")
-            return True
+        return True
 
     except Exception as e:
         logger.error(f"Error during Excel synchronization: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def export_attendance_history() -> bool:
+    """出席記録全体を attendance_history.csv（旧形式）に書き出す。失敗したらFalse"""
+    try:
+        offline_storage.export_history_csv(ATTENDANCE_HISTORY_FILE)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to export attendance history: {e}")
+        return False
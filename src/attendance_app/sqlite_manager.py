@@ -0,0 +1,207 @@
+"""
+SQLite connection management for Attendance Management System v3.4
+Keeps one long-lived connection per thread for reads, so prepared statements stay
+in sqlite3's statement cache, and funnels every write through a single writer
+thread. The writer group-commits: it collects write jobs for a few milliseconds
+(or until a batch is full), commits them in one transaction with a single fsync,
+and then resolves each job's future.
+Safe to use from the Kivy UI thread and from short-lived worker threads.
+"""
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Prepared statements kept per connection (sqlite3's LRU statement cache)
+STATEMENT_CACHE_SIZE = 256
+
+# Seconds to wait for a lock held by another process
+BUSY_TIMEOUT = 30.0
+
+_STOP = object()
+
+
+class SQLiteConnectionManager:
+    """Per-thread read connections and a single group-commit writer thread for one database.
+
+    batch_interval: seconds the writer waits for more jobs after the first one of a batch
+    batch_size: maximum number of jobs committed together
+    queue_size: bound of the write queue; jobs submitted while it is full fail at once
+    journal_mode: WAL by default; use DELETE for database files on a network share
+    """
+
+    def __init__(self, db_path: Path, batch_interval: float = 0.01, batch_size: int = 64,
+                 queue_size: int = 1000, journal_mode: str = "WAL"):
+        self.db_path = Path(db_path)
+        self.journal_mode = journal_mode
+        self.batch_interval = batch_interval
+        self.batch_size = max(1, batch_size)
+        self._local = threading.local()
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+
+    def _connect(self, **kwargs) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), timeout=BUSY_TIMEOUT,
+                               cached_statements=STATEMENT_CACHE_SIZE, **kwargs)
+        conn.row_factory = sqlite3.Row  # Enable dict-like row access
+        # With WAL, NORMAL only fsyncs at checkpoints and is still corruption-safe
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Return the calling thread's long-lived connection (for reads)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Closed by the garbage collector when the thread ends
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    # --- writer -----------------------------------------------------------
+
+    def _ensure_writer(self) -> None:
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._writer_loop, name="sqlite-writer", daemon=True)
+                self._writer.start()
+
+    def submit(self, work: Callable[[sqlite3.Connection], T], transaction: bool = True) -> "Future[T]":
+        """
+        Queue a write job without waiting for it. It runs on the writer thread, and the
+        returned future resolves once its batch is committed to disk.
+        transaction=False runs the job on its own outside any transaction (VACUUM and
+        other maintenance statements).
+        Never blocks (it is called from the Kivy UI thread): if the queue is full, the
+        returned future has already failed with queue.Full.
+        """
+        future: "Future[T]" = Future()
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((work, future, transaction))
+        except queue.Full as e:
+            logger.error(f"Write queue of {self.db_path} is full ({self._queue.maxsize} jobs); write rejected")
+            future.set_exception(e)
+        return future
+
+    def write(self, work: Callable[[sqlite3.Connection], T], transaction: bool = True) -> T:
+        """Run a write job on the writer thread and wait until it is committed."""
+        if threading.current_thread() is self._writer:
+            raise RuntimeError("write() must not be called from a write job")
+        return self.submit(work, transaction).result()
+
+    def _open_writer_connection(self) -> sqlite3.Connection:
+        conn = self._connect(isolation_level=None)  # transactions are managed explicitly
+        try:
+            # WAL lets readers run while the writer commits (persistent per database)
+            conn.execute(f'PRAGMA journal_mode={self.journal_mode}')
+            # Committed batches must survive a power cut: one WAL fsync per batch commit
+            conn.execute('PRAGMA synchronous=FULL')
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _writer_loop(self) -> None:
+        conn: Optional[sqlite3.Connection] = None
+        try:
+            while True:
+                job = self._queue.get()
+                if job is _STOP:
+                    return
+                if conn is None:
+                    # Opened on the first job, and retried on the next one if the database
+                    # cannot be opened (e.g. an unreachable share), so no caller waits forever
+                    try:
+                        conn = self._open_writer_connection()
+                    except Exception as e:
+                        logger.error(f"Cannot open {self.db_path} for writing: {e}")
+                        job[1].set_exception(e)
+                        continue
+                if not job[2]:
+                    self._run_alone(conn, job)
+                    continue
+                batch = [job]
+                stop = False
+                deferred = None
+                # Group commit: keep collecting until the batch is full or the interval has passed
+                deadline = time.monotonic() + self.batch_interval
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is _STOP:
+                        stop = True
+                        break
+                    if not job[2]:
+                        deferred = job  # runs right after this batch, keeping queue order
+                        break
+                    batch.append(job)
+                self._run_batch(conn, batch)
+                if deferred is not None:
+                    self._run_alone(conn, deferred)
+                if stop:
+                    return
+        finally:
+            if conn is not None:
+                conn.close()
+
+    @staticmethod
+    def _run_alone(conn: sqlite3.Connection, job: Tuple[Callable, Future, bool]) -> None:
+        """Run a job outside any transaction (autocommit)."""
+        work, future, _ = job
+        try:
+            future.set_result(work(conn))
+        except Exception as e:
+            logger.error(f"SQLite maintenance job failed: {e}")
+            future.set_exception(e)
+
+    def _run_batch(self, conn: sqlite3.Connection, batch: List[Tuple[Callable, Future, bool]]) -> None:
+        """Run write jobs in one transaction; a failing job is rolled back on its own."""
+        outcomes = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for work, future, _ in batch:
+                conn.execute('SAVEPOINT job')
+                try:
+                    outcomes.append((future, work(conn), None))
+                    conn.execute('RELEASE job')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO job')
+                    conn.execute('RELEASE job')
+                    outcomes.append((future, None, e))
+            conn.execute('COMMIT')
+            logger.debug(f"Committed {len(batch)} write job(s)")
+        except Exception as e:
+            logger.error(f"SQLite write transaction failed: {e}")
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        # Results are released only after the commit, so callers never see uncommitted data
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def close(self) -> None:
+        """Stop the writer thread after the queued writes are committed."""
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+        if writer is not None and writer.is_alive():
+            self._queue.put(_STOP)  # queued after the pending jobs, so they are committed first
+            writer.join()
@@ -9,8 +9,9 @@ from typing import Dict, List, Optional, Tuple
 from openpyxl import load_workbook
 from openpyxl.utils import get_column_letter
 
+from attendance_app.file_lock import atomic_path, file_lock
 from attendance_app.path_manager import get_asset_path
-from attendance_app.spreadsheet import _read_student_data_from_excel
+from attendance_app.student_roster import student_roster
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +28,11 @@ class StudentDataManager:
             excel_file_path = get_asset_path('Sample_Data.xlsm')
         return excel_file_path
     
+    def _save_workbook(self, workbook):
+        """ブックを一時ファイルに保存してから置き換える（保存途中のファイルを他の処理に読ませない）"""
+        with file_lock(self.excel_file_path), atomic_path(self.excel_file_path) as tmp_path:
+            workbook.save(tmp_path)
+    
     def generate_student_id(self) -> str:
         """
         学籍番号を自動生成
@@ -38,7 +44,7 @@ class StudentDataManager:
             year_suffix = str(current_year)[-2:]
             
             # 既存の学生IDから最大番号を取得
-            existing_students = _read_student_data_from_excel()
+            existing_students = student_roster.all_students()
             max_number = 0
             
             prefix = f"{year_suffix}D"
@@ -94,7 +100,7 @@ class StudentDataManager:
                 for col, header in enumerate(headers, 1):
                     sheet.cell(row=1, column=col, value=header)
                 
-                workbook.save(self.excel_file_path)
+                self._save_workbook(workbook)
                 logger.info("StudentsList sheet created successfully")
             
         except Exception as e:
@@ -138,7 +144,7 @@ class StudentDataManager:
             # F, G列は空
             sheet.cell(row=next_row, column=8, value=student_data['birth_date'])      # H: 生年月日
             
-            workbook.save(self.excel_file_path)
+            self._save_workbook(workbook)
             logger.info(f"Student data added to StudentsList sheet: {student_data['student_name']}")
             return True
             
@@ -176,7 +182,7 @@ class StudentDataManager:
             sheet.cell(row=next_row, column=1, value=student_id)
             sheet.cell(row=next_row, column=2, value=student_name)
             
-            workbook.save(self.excel_file_path)
+            self._save_workbook(workbook)
             logger.info(f"Student ID added to StudentID_StudentName sheet: {student_id} - {student_name}")
             return True
             
@@ -195,17 +201,22 @@ class StudentDataManager:
             Tuple[bool, str, str]: (成功フラグ, 学籍番号, エラーメッセージ)
         """
         try:
-            # 学籍番号を生成
-            student_id = self.generate_student_id()
-            
-            # StudentsListシートに追加
-            if not self.add_student_to_student_list(student_data):
-                return False, "", "StudentsListシートへの書き込みに失敗しました"
-            
-            # StudentID_StudentNameシートに追加
-            if not self.add_student_to_student_id_name(student_id, student_data['student_name']):
-                return False, student_id, "StudentID_StudentNameシートへの書き込みに失敗しました"
-            
+            # 学籍番号の採番から書き込みまでをロックし、他の端末・処理と番号や行が重ならないようにする
+            with file_lock(self.excel_file_path):
+                # 学籍番号を生成
+                student_id = self.generate_student_id()
+                
+                # StudentsListシートに追加
+                if not self.add_student_to_student_list(student_data):
+                    return False, "", "StudentsListシートへの書き込みに失敗しました"
+                
+                # StudentID_StudentNameシートに追加
+                if not self.add_student_to_student_id_name(student_id, student_data['student_name']):
+                    return False, student_id, "StudentID_StudentNameシートへの書き込みに失敗しました"
+                
+                # 名簿キャッシュを更新（再起動せずにすぐスキャンできるようにする）
+                student_roster.add_student(student_id, student_data['student_name'])
+                
             logger.info(f"Successfully registered new student: {student_data['student_name']} ({student_id})")
             return True, student_id, ""
             
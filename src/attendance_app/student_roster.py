@@ -0,0 +1,155 @@
+"""
+Student roster service for Attendance Management System v3.4
+Keeps the StudentID -> StudentName mapping of Sample_Data.xlsx in memory and
+reloads it only when the workbook changes on disk (mtime or size).
+"""
+
+import io
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from attendance_app.path_manager import get_asset_path
+
+logger = logging.getLogger(__name__)
+
+ROSTER_SHEET = 'StudentID_StudentName'
+
+
+class RosterError(Exception):
+    """Raised when the student roster cannot be loaded."""
+    pass
+
+
+def get_student_workbook_path() -> Path:
+    """Sample_Data.xlsx を優先し、なければ Sample_Data.xlsm のパスを返す"""
+    excel_file_path = get_asset_path('Sample_Data.xlsx')
+    if not excel_file_path.exists():
+        excel_file_path = get_asset_path('Sample_Data.xlsm')
+    return excel_file_path
+
+
+def load_student_records(excel_file_path: Path) -> List[Dict[str, str]]:
+    """Reads student data from the StudentID_StudentName sheet of the given workbook."""
+    if not excel_file_path.exists():
+        raise RosterError(f"Student data file not found: {excel_file_path}")
+
+    student_list = []
+    workbook = None
+    try:
+        # 読み取り専用モードで名簿シートだけをストリーミングで読み込む
+        # （Attendance_Information シートの肥大化に読み込み時間が影響されない）
+        # ファイルはメモリに読み込んでから開き、解析中にブックの置き換え（保存）を妨げない
+        from openpyxl import load_workbook
+        workbook = load_workbook(io.BytesIO(excel_file_path.read_bytes()), read_only=True, data_only=True)
+        sheet = workbook[ROSTER_SHEET] # StudentID_StudentName シートを指定
+        rows = sheet.iter_rows(values_only=True)
+
+        # 1行目をヘッダーとして取得
+        headers = list(next(rows, ()))
+
+        # StudentIDとStudentNameの列インデックスを特定
+        student_id_col_idx = -1
+        student_name_col_idx = -1
+        for i, header in enumerate(headers):
+            if header == 'StudentID':
+                student_id_col_idx = i
+            elif header == 'StudentName':
+                student_name_col_idx = i
+
+        if student_id_col_idx == -1 or student_name_col_idx == -1:
+            raise RosterError("Required headers 'StudentID' or 'StudentName' not found in StudentID_StudentName sheet.")
+
+        for row_data in rows: # 2行目からデータを読み込む
+            if len(row_data) <= max(student_id_col_idx, student_name_col_idx):
+                continue
+            if row_data[student_id_col_idx] is None and row_data[student_name_col_idx] is None:
+                continue # 書式だけが残った空行
+            student_id = str(row_data[student_id_col_idx]).strip()
+            student_name = str(row_data[student_name_col_idx]).strip()
+            student_list.append({"id": student_id, "name": student_name})
+    except RosterError:
+        raise
+    except ImportError:
+        raise RosterError("openpyxl library not found. Please install it: pip install openpyxl")
+    except OSError as e:
+        raise RosterError(f"Failed to read student data Excel: {e}")
+    except KeyError:
+        raise RosterError(f"Sheet '{ROSTER_SHEET}' not found in {excel_file_path.name}. Please check the sheet name.")
+    except Exception as e:
+        raise RosterError(f"Failed to process student data Excel: {e}")
+    finally:
+        if workbook is not None:
+            workbook.close() # read_only モードではファイルハンドルを明示的に閉じる
+    return student_list
+
+
+class StudentRoster:
+    """In-memory student roster keyed by student ID."""
+
+    def __init__(self, workbook_path: Optional[Path] = None):
+        self._workbook_path = workbook_path
+        self._lock = threading.Lock()
+        self._students: List[Dict[str, str]] = []
+        self._names: Dict[str, str] = {}
+        # (path, mtime_ns, size) of the workbook the roster was loaded from
+        self._signature: Optional[Tuple[str, int, int]] = None
+
+    @property
+    def workbook_path(self) -> Path:
+        return self._workbook_path or get_student_workbook_path()
+
+    def _current_signature(self) -> Optional[Tuple[str, int, int]]:
+        path = self.workbook_path
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        return str(path), stat.st_mtime_ns, stat.st_size
+
+    def _ensure_loaded(self):
+        """Reload the roster if the workbook changed since the last load."""
+        signature = self._current_signature()
+        if signature is not None and signature == self._signature:
+            return
+
+        students = load_student_records(self.workbook_path)
+        names: Dict[str, str] = {}
+        for student in students:
+            # Keep the first occurrence, like the former linear scan did
+            names.setdefault(student["id"], student["name"])
+
+        self._students = students
+        self._names = names
+        self._signature = signature
+        logger.info(f"Loaded student roster: {len(names)} students from {self.workbook_path}")
+
+    def get_name(self, student_id: str) -> Optional[str]:
+        """Return the student's name, or None if the ID is not registered."""
+        with self._lock:
+            self._ensure_loaded()
+            return self._names.get(str(student_id))
+
+    def all_students(self) -> List[Dict[str, str]]:
+        """Return all students in workbook order as [{"id": ..., "name": ...}]."""
+        with self._lock:
+            self._ensure_loaded()
+            return [dict(student) for student in self._students]
+
+    def add_student(self, student_id: str, student_name: str) -> None:
+        """Register a student that was just written to the workbook without reloading it."""
+        with self._lock:
+            if self._signature is None:
+                # Nothing cached yet; the next lookup loads the updated workbook
+                return
+            student_id = str(student_id).strip()
+            student_name = str(student_name).strip()
+            self._students.append({"id": student_id, "name": student_name})
+            self._names.setdefault(student_id, student_name)
+            # The caller has saved the workbook, so the new file state is already reflected
+            self._signature = self._current_signature()
+
+
+# Global roster instance
+student_roster = StudentRoster()
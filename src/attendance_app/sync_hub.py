@@ -0,0 +1,413 @@
+"""
+LAN sync hub for Attendance Management System v3.4
+Shares the attendance records of two or three kiosks on one site through one
+central database, which is also a backup and a single place to export them from.
+The hub is a small HTTP server backed by SQLite. Each kiosk keeps writing to its
+own OfflineStorage, whose unsynced records (synced = FALSE) act as a local
+write-ahead queue, and the sync worker (sync_worker.py) pushes them to the hub
+in batches whenever it is reachable. It then pulls the changes of the other
+kiosks and merges them into its store by (kiosk, record ID), so every kiosk sees
+the shared history and a student can scan out at a different kiosk from the one
+they entered at (once both have synced).
+
+Every request must carry the shared SYNC_HUB_TOKEN; the hub refuses to listen
+beyond the local machine without one. Run the hub on one machine of the LAN:
+    SYNC_HUB_TOKEN=<secret> python -m attendance_app.sync_hub --host 0.0.0.0 --port 8765 --database hub.db
+and set SYNC_HUB_URL=http://<hub address>:8765, the same SYNC_HUB_TOKEN and a
+unique KIOSK_ID on each kiosk. The collected records of all kiosks are exported with
+    python -m attendance_app.sync_hub --database hub.db --export-csv all_kiosks.csv
+"""
+
+import argparse
+import csv
+import hmac
+import ipaddress
+import json
+import logging
+import threading
+import urllib.error
+import urllib.request
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from attendance_app.file_lock import atomic_write
+from attendance_app.history_format import HISTORY_COLUMNS
+from attendance_app.offline_storage import RESPONSE_FIELDS
+from attendance_app.settings import settings_manager
+from attendance_app.sqlite_manager import SQLiteConnectionManager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+
+# Seconds a kiosk waits for the hub before treating it as unreachable
+REQUEST_TIMEOUT = 5.0
+
+# Largest request body the hub accepts
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+
+# Most records returned by one pull
+MAX_PULL_RECORDS = 5000
+
+# Hub revisions come from a one-row counter that only goes up (like the kiosk store's)
+HUB_REVISION_COUNTER_TABLE = "hub_revision_counter"
+
+
+def history_values(row) -> List[str]:
+    """Convert a hub row (answers in the responses JSON pushed by the kiosk) to the attendance_history.csv layout."""
+    responses = json.loads(row['responses']) if row['responses'] else {}
+    return [row['entry_time'], row['student_id'], row['student_name'],
+            *(str(responses.get(field) or "") for field in RESPONSE_FIELDS),
+            row['exit_time'] or ""]
+
+
+class SyncHubError(Exception):
+    """Raised when the sync hub cannot be reached or rejects a request."""
+    pass
+
+
+class SyncHubStore:
+    """SQLite store of the hub: the records of every kiosk, keyed by (kiosk_id, record_id)."""
+
+    def __init__(self, db_path: Path, journal_mode: str = "WAL"):
+        self.db_path = Path(db_path)
+        self._db = SQLiteConnectionManager(self.db_path, journal_mode=journal_mode)
+        self._db.write(self._create_schema)
+
+    @staticmethod
+    def _create_schema(conn) -> None:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS hub_records (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kiosk_id TEXT NOT NULL,
+                record_id INTEGER NOT NULL,
+                source_kiosk TEXT,
+                source_revision INTEGER NOT NULL,
+                student_id TEXT NOT NULL,
+                student_name TEXT NOT NULL,
+                entry_time TEXT NOT NULL,
+                exit_time TEXT,
+                responses TEXT,
+                updated_at TEXT NOT NULL,
+                received_at TEXT NOT NULL,
+                revision INTEGER NOT NULL,
+                UNIQUE (kiosk_id, record_id)
+            )
+        ''')
+        # Hubs created before kiosks could update each other's records
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(hub_records)')]
+        if 'source_kiosk' not in columns:
+            conn.execute('ALTER TABLE hub_records ADD COLUMN source_kiosk TEXT')
+            conn.execute('UPDATE hub_records SET source_kiosk = kiosk_id')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_hub_revision ON hub_records (revision)')
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {HUB_REVISION_COUNTER_TABLE} (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                value INTEGER NOT NULL
+            )
+        ''')
+        conn.execute(f'''
+            INSERT OR IGNORE INTO {HUB_REVISION_COUNTER_TABLE} (id, value)
+            SELECT 1, COALESCE(MAX(revision), 0) FROM hub_records
+        ''')
+
+    def upsert_records(self, kiosk_id: str, records: List[Dict[str, Any]]) -> int:
+        """
+        Store a batch pushed by a kiosk in one transaction and return the hub revision.
+        Records the kiosk merged from another kiosk are stored under their origin.
+        Re-sent or out-of-order batches of a kiosk never overwrite a newer state of a record,
+        and an exit time is never cleared by a state that has not seen it.
+        """
+        received_at = datetime.now().isoformat()
+        params = []
+        for record in records:
+            responses = record.get('responses')
+            if isinstance(responses, dict):
+                responses = json.dumps(responses, ensure_ascii=False) if responses else None
+            if record.get('origin_kiosk'):
+                origin = (str(record['origin_kiosk']), int(record['origin_id']))
+            else:
+                origin = (kiosk_id, int(record['id']))
+            params.append((*origin, kiosk_id, int(record.get('revision') or 0),
+                           str(record['student_id']), str(record['student_name']), str(record['entry_time']),
+                           record.get('exit_time'), responses, record.get('updated_at') or received_at,
+                           received_at))
+
+        def upsert(conn) -> int:
+            revision = conn.execute(
+                f'SELECT value FROM {HUB_REVISION_COUNTER_TABLE} WHERE id = 1').fetchone()[0]
+            for values in params:
+                # A stale record that is not applied does not use up a revision
+                applied = conn.execute('''
+                    INSERT INTO hub_records
+                    (kiosk_id, record_id, source_kiosk, source_revision, student_id, student_name,
+                     entry_time, exit_time, responses, updated_at, received_at, revision)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (kiosk_id, record_id) DO UPDATE SET
+                        source_kiosk = excluded.source_kiosk,
+                        source_revision = excluded.source_revision,
+                        student_id = excluded.student_id,
+                        student_name = excluded.student_name,
+                        entry_time = excluded.entry_time,
+                        exit_time = COALESCE(excluded.exit_time, hub_records.exit_time),
+                        responses = excluded.responses,
+                        updated_at = excluded.updated_at,
+                        received_at = excluded.received_at,
+                        revision = excluded.revision
+                    WHERE excluded.source_kiosk IS NOT hub_records.source_kiosk
+                       OR excluded.source_revision > hub_records.source_revision
+                ''', values + (revision + 1,)).rowcount
+                revision += applied
+            conn.execute(f'UPDATE {HUB_REVISION_COUNTER_TABLE} SET value = ? WHERE id = 1', (revision,))
+            return revision
+
+        revision = self._db.write(upsert)
+        logger.info(f"Stored {len(params)} records from kiosk {kiosk_id} (hub revision {revision})")
+        return revision
+
+    def records_since(self, since_revision: int, limit: int) -> List[Dict[str, Any]]:
+        """Get up to limit records changed after since_revision, in hub revision order (for kiosks to pull)."""
+        rows = self._db.connection().execute('''
+            SELECT kiosk_id, record_id, revision, student_id, student_name, entry_time, exit_time,
+                   responses, updated_at
+            FROM hub_records
+            WHERE revision > ?
+            ORDER BY revision
+            LIMIT ?
+        ''', (since_revision, limit)).fetchall()
+        records = [dict(row) for row in rows]
+        for record in records:
+            record['responses'] = json.loads(record['responses']) if record['responses'] else None
+        return records
+
+    def export_history_csv(self, path: Path) -> int:
+        """Write the records of all kiosks in the attendance_history.csv layout (plus KioskID); returns the count."""
+        rows = self._db.connection().execute('''
+            SELECT kiosk_id, student_id, student_name, entry_time, exit_time, responses
+            FROM hub_records
+            ORDER BY entry_time, kiosk_id, record_id
+        ''').fetchall()
+        with atomic_write(Path(path), 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(HISTORY_COLUMNS + ["KioskID"])
+            writer.writerows(history_values(row) + [row['kiosk_id']] for row in rows)
+        logger.info(f"Exported {len(rows)} hub records to {path}")
+        return len(rows)
+
+    def current_revision(self) -> int:
+        """Get the revision of the latest change received by the hub."""
+        return self._db.connection().execute(
+            f'SELECT value FROM {HUB_REVISION_COUNTER_TABLE} WHERE id = 1').fetchone()[0]
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class _HubRequestHandler(BaseHTTPRequestHandler):
+    """JSON API: GET /health, GET /records?since=<hub revision>&limit=<n>, POST /records"""
+
+    server: "SyncHubServer"
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        """Check the shared token; sends 401 and returns False if it is missing or wrong."""
+        token = self.server.token
+        if token is None:
+            return True
+        supplied = self.headers.get('Authorization', '')
+        if hmac.compare_digest(supplied.encode('utf-8'), f"Bearer {token}".encode('utf-8')):
+            return True
+        logger.warning(f"Rejected unauthenticated sync hub request from {self.address_string()}")
+        self._send_json(401, {"error": "Missing or invalid sync hub token"})
+        return False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        url = urlparse(self.path)
+        store = self.server.store
+        try:
+            if url.path == '/health':
+                self._send_json(200, {"status": "ok", "revision": store.current_revision()})
+            elif url.path == '/records':
+                query = parse_qs(url.query)
+                since = int(query.get('since', ['0'])[0])
+                limit = min(max(1, int(query.get('limit', [str(MAX_PULL_RECORDS)])[0])), MAX_PULL_RECORDS)
+                self._send_json(200, {"records": store.records_since(since, limit)})
+            else:
+                self._send_json(404, {"error": f"Unknown path {url.path}"})
+        except ValueError as e:
+            self._send_json(400, {"error": f"Invalid request: {e}"})
+        except Exception as e:
+            logger.error(f"Sync hub request failed: {e}")
+            self._send_json(500, {"error": str(e)})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        url = urlparse(self.path)
+        if url.path != '/records':
+            self._send_json(404, {"error": f"Unknown path {url.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > MAX_REQUEST_BYTES:
+                self._send_json(413, {"error": "Request too large"})
+                return
+            payload = json.loads(self.rfile.read(length).decode('utf-8'))
+            kiosk_id = str(payload['kiosk_id'])
+            records = payload['records']
+            revision = self.server.store.upsert_records(kiosk_id, records)
+            self._send_json(200, {"accepted": len(records), "revision": revision})
+        except (KeyError, TypeError, ValueError) as e:
+            self._send_json(400, {"error": f"Invalid request: {e}"})
+        except Exception as e:
+            logger.error(f"Sync hub request failed: {e}")
+            self._send_json(500, {"error": str(e)})
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def is_loopback(host: str) -> bool:
+    """True if the listen address is only reachable from this machine."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class SyncHubServer(ThreadingHTTPServer):
+    """HTTP front end of a SyncHubStore. Port 0 picks a free port (for a local stand-in hub).
+
+    token: shared secret every request must send as "Authorization: Bearer <token>".
+    It may only be omitted when listening on a loopback address.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, store: SyncHubStore, host: str = "127.0.0.1", port: int = DEFAULT_PORT,
+                 token: Optional[str] = None):
+        if not token and not is_loopback(host):
+            raise ValueError(f"A sync hub token (SYNC_HUB_TOKEN) is required to listen on {host}")
+        self.store = store
+        self.token = token or None
+        super().__init__((host, port), _HubRequestHandler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        """Serve in a background thread and return the hub URL."""
+        self._thread = threading.Thread(target=self.serve_forever, name="sync-hub", daemon=True)
+        self._thread.start()
+        logger.info(f"Sync hub listening on {self.url} ({self.store.db_path})")
+        return self.url
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        self.store.close()
+
+
+class SyncHubClient:
+    """Kiosk side of the hub API."""
+
+    def __init__(self, base_url: str, kiosk_id: str, token: Optional[str] = None,
+                 timeout: float = REQUEST_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.kiosk_id = kiosk_id
+        self.token = token
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, payload: Optional[dict] = None) -> dict:
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        request = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            raise SyncHubError(f"Sync hub returned HTTP {e.code} for {method} {path}: {e.read()[:200]!r}")
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise SyncHubError(f"Sync hub {self.base_url} unreachable: {e}")
+
+    def health(self) -> dict:
+        return self._request('GET', '/health')
+
+    def push_records(self, records: List[Dict[str, Any]]) -> int:
+        """Send a batch of records (as returned by get_unsynced_records) and return the hub revision."""
+        response = self._request('POST', '/records', {"kiosk_id": self.kiosk_id, "records": records})
+        return response["revision"]
+
+    def pull_records(self, since_revision: int, limit: int) -> List[Dict[str, Any]]:
+        """Get up to limit records of all kiosks changed after a hub revision, in revision order."""
+        query = urlencode({"since": since_revision, "limit": limit})
+        return self._request('GET', f'/records?{query}')["records"]
+
+
+def get_hub_client() -> Optional[SyncHubClient]:
+    """Return a client for SYNC_HUB_URL, or None if this kiosk runs standalone."""
+    settings = settings_manager.settings
+    if not settings.sync_hub_url:
+        return None
+    return SyncHubClient(settings.sync_hub_url, settings.kiosk_id, settings.sync_hub_token)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run a sync hub in the foreground, or export its records with --export-csv."""
+    parser = argparse.ArgumentParser(description="Attendance sync hub for multiple kiosks")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address to listen on (default: this machine only; use 0.0.0.0 for the LAN)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--token", default=settings_manager.settings.sync_hub_token,
+                        help="shared secret the kiosks send (default: SYNC_HUB_TOKEN)")
+    parser.add_argument("--database", default=str(settings_manager.get_absolute_path("attendance_hub.db")),
+                        help="SQLite file of the hub")
+    parser.add_argument("--export-csv", metavar="PATH",
+                        help="write the records of all kiosks to a CSV file and exit")
+    args = parser.parse_args(argv)
+
+    if args.export_csv:
+        store = SyncHubStore(Path(args.database))
+        try:
+            store.export_history_csv(Path(args.export_csv))
+        finally:
+            store.close()
+        return
+
+    if not args.token and not is_loopback(args.host):
+        parser.error(f"--token or SYNC_HUB_TOKEN is required to listen on {args.host}")
+
+    server = SyncHubServer(SyncHubStore(Path(args.database)), args.host, args.port, args.token)
+    logger.info(f"Sync hub listening on {server.url} ({args.database})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.store.close()
+
+
+if __name__ == "__main__":
+    main()
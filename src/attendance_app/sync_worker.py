@@ -0,0 +1,250 @@
+"""
+Background sync worker for Attendance Management System v3.4
+Drains the unsynced records of OfflineStorage (its local write-ahead queue) to a
+pluggable target in batches: the sync hub over HTTP, a central SQLite file, or
+the Sample_Data workbook. After uploading it pulls the records other kiosks stored
+in the hub (or central SQLite file) and merges them into OfflineStorage. It runs
+on its own thread and backs off exponentially while the target is unavailable, so
+the kiosk never waits for it. Every batch is logged to sync_log with its latency
+and throughput.
+"""
+
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from attendance_app.offline_storage import OfflineStorage, offline_storage
+from attendance_app.settings import settings_manager
+from attendance_app.spreadsheet import excel_synced_revision, sync_attendance_to_excel
+from attendance_app.sync_hub import SyncHubClient, SyncHubStore, get_hub_client
+
+logger = logging.getLogger(__name__)
+
+
+class SyncError(Exception):
+    """Raised when a batch could not be uploaded."""
+    pass
+
+
+class SyncTarget(ABC):
+    """Destination of the sync worker."""
+
+    name = "target"
+    # False if upload() always stores every change since the last sync (the whole queue is one batch)
+    batched = True
+
+    @abstractmethod
+    def upload(self, records: List[Dict[str, Any]]) -> None:
+        """Store a batch of records; must raise if it was not stored."""
+
+    def pull(self, since_revision: int, limit: int) -> List[Dict[str, Any]]:
+        """Records of all kiosks changed after a hub revision; targets without them return none."""
+        return []
+
+    def close(self) -> None:
+        pass
+
+
+class HttpSyncTarget(SyncTarget):
+    """The LAN sync hub (or any endpoint implementing its POST /records API)."""
+
+    name = "http"
+
+    def __init__(self, client: SyncHubClient):
+        self.client = client
+
+    def upload(self, records: List[Dict[str, Any]]) -> None:
+        self.client.push_records(records)
+
+    def pull(self, since_revision: int, limit: int) -> List[Dict[str, Any]]:
+        return self.client.pull_records(since_revision, limit)
+
+
+class SQLiteFileSyncTarget(SyncTarget):
+    """A central SQLite file, e.g. on a shared folder, in the sync hub's schema."""
+
+    name = "sqlite"
+
+    def __init__(self, path: Path, kiosk_id: str):
+        self.kiosk_id = kiosk_id
+        # WAL does not work on network file systems; use a rollback journal
+        self.store = SyncHubStore(path, journal_mode="DELETE")
+
+    def upload(self, records: List[Dict[str, Any]]) -> None:
+        self.store.upsert_records(self.kiosk_id, records)
+
+    def pull(self, since_revision: int, limit: int) -> List[Dict[str, Any]]:
+        return self.store.records_since(since_revision, limit)
+
+    def close(self) -> None:
+        self.store.close()
+
+
+class ExcelSyncTarget(SyncTarget):
+    """The Attendance_Information sheet of Sample_Data.xlsx."""
+
+    name = "excel"
+    # sync_attendance_to_excel() applies every change since its last run in one workbook save
+    batched = False
+
+    def upload(self, records: List[Dict[str, Any]]) -> None:
+        # Already in the workbook if it was synced since (from the report screen): skip the lock and load
+        if excel_synced_revision() >= offline_storage.current_revision():
+            return
+        if not sync_attendance_to_excel():
+            raise SyncError("Excel synchronization failed")
+
+
+class SyncWorker:
+    """Uploads unsynced records in batches, and merges the other kiosks' records, on a background thread."""
+
+    def __init__(self, target: SyncTarget, storage: OfflineStorage = offline_storage,
+                 batch_size: Optional[int] = None, interval: Optional[float] = None,
+                 max_backoff: Optional[float] = None, kiosk_id: Optional[str] = None):
+        settings = settings_manager.settings
+        self.target = target
+        self.storage = storage
+        self.kiosk_id = kiosk_id or settings.kiosk_id
+        self.batch_size = batch_size or settings.sync_batch_size
+        self.interval = interval if interval is not None else settings.sync_interval_seconds
+        self.max_backoff = max_backoff if max_backoff is not None else settings.sync_max_backoff_seconds
+        self._failures = 0
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name=f"sync-{self.target.name}", daemon=True)
+        self._thread.start()
+        logger.info(f"Background sync to {self.target.name} started")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.target.close()
+
+    def next_delay(self) -> float:
+        """Seconds until the next attempt: the interval, doubled for every consecutive failure."""
+        if not self._failures:
+            return self.interval
+        return min(self.max_backoff, max(self.interval, 1.0) * 2 ** self._failures)
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                self.sync()
+            except SyncError:
+                pass  # already logged; retried after the backoff
+            except Exception as e:
+                self._failures += 1
+                logger.error(f"Background sync failed: {e}")
+            self._wake.wait(self.next_delay())
+            self._wake.clear()
+
+    def sync(self) -> None:
+        """Upload the queue, then merge what the other kiosks uploaded."""
+        self.drain()
+        self.pull()
+
+    def drain(self) -> int:
+        """Upload batches until the queue is empty; returns the number of records uploaded."""
+        total = 0
+        while not self._stopping.is_set():
+            uploaded = self.sync_batch()
+            total += uploaded
+            if not self.target.batched or uploaded < self.batch_size:
+                break
+        return total
+
+    def sync_batch(self) -> int:
+        """Upload one batch and mark it synced. Raises SyncError (after logging it) on failure."""
+        records = self.storage.get_unsynced_records(self.batch_size if self.target.batched else None)
+        if not records:
+            return 0
+
+        action = f"{self.target.name}_upload"
+        started = time.perf_counter()
+        try:
+            self.target.upload(records)
+            # Records changed again while the batch was in flight keep their unsynced flag
+            if not self.storage.mark_records_synced([record['id'] for record in records],
+                                                    up_to_revision=max(record['revision'] for record in records)):
+                raise SyncError("Could not mark uploaded records as synced")
+        except Exception as e:
+            duration_ms = (time.perf_counter() - started) * 1000
+            self._failures += 1
+            self.storage.log_sync_attempt(action, "failed", str(e), len(records), duration_ms)
+            logger.warning(f"Uploading {len(records)} records to {self.target.name} failed "
+                           f"(retrying in {self.next_delay():.0f}s): {e}")
+            raise SyncError(str(e)) from e
+
+        duration_ms = (time.perf_counter() - started) * 1000
+        self._failures = 0
+        self.storage.log_sync_attempt(action, "success", None, len(records), duration_ms)
+        logger.info(f"Uploaded {len(records)} records to {self.target.name} in {duration_ms:.0f} ms")
+        return len(records)
+
+    def pull(self) -> int:
+        """
+        Merge the records changed in the target since the last pull, in batches.
+        Returns the number of records pulled; raises SyncError (after logging it) on failure.
+        """
+        total = 0
+        while not self._stopping.is_set():
+            action = f"{self.target.name}_pull"
+            started = time.perf_counter()
+            try:
+                records = self.target.pull(self.storage.pulled_revision(), self.batch_size)
+                if not records:
+                    break
+                self.storage.merge_remote_records(self.kiosk_id, records,
+                                                  max(record['revision'] for record in records))
+            except Exception as e:
+                duration_ms = (time.perf_counter() - started) * 1000
+                self._failures += 1
+                self.storage.log_sync_attempt(action, "failed", str(e), 0, duration_ms)
+                logger.warning(f"Pulling records from {self.target.name} failed "
+                               f"(retrying in {self.next_delay():.0f}s): {e}")
+                raise SyncError(str(e)) from e
+
+            duration_ms = (time.perf_counter() - started) * 1000
+            self.storage.log_sync_attempt(action, "success", None, len(records), duration_ms)
+            total += len(records)
+            if len(records) < self.batch_size:
+                break
+        return total
+
+
+def create_sync_target() -> Optional[SyncTarget]:
+    """Build the target chosen by SYNC_TARGET (http if only SYNC_HUB_URL is set), or None."""
+    settings = settings_manager.settings
+    kind = (settings.sync_target or ("http" if settings.sync_hub_url else "none")).strip().lower()
+    if kind == "none":
+        return None
+    if kind == "http":
+        client = get_hub_client()
+        if client is None:
+            logger.warning("SYNC_TARGET=http requires SYNC_HUB_URL; background sync disabled")
+            return None
+        return HttpSyncTarget(client)
+    if kind == "sqlite":
+        if not settings.sync_sqlite_path:
+            logger.warning("SYNC_TARGET=sqlite requires SYNC_SQLITE_PATH; background sync disabled")
+            return None
+        return SQLiteFileSyncTarget(settings_manager.get_absolute_path(settings.sync_sqlite_path),
+                                    settings.kiosk_id)
+    if kind == "excel":
+        return ExcelSyncTarget()
+    logger.warning(f"Unknown SYNC_TARGET '{kind}'; background sync disabled")
+    return None
+
+
+def create_sync_worker() -> Optional[SyncWorker]:
+    """Return a (not yet started) worker for the configured target, or None if sync is off."""
+    target = create_sync_target()
+    return SyncWorker(target) if target is not None else None
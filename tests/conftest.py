@@ -0,0 +1,17 @@
+"""
+Test setup: import attendance_app from src/ and keep the global stores
+(attendance database, output directory) in a temporary directory.
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+# Must be set before attendance_app.settings is imported
+_TEST_DIR = Path(tempfile.mkdtemp(prefix="attendance-tests-"))
+os.environ["DATABASE_URL"] = f"sqlite:///{(_TEST_DIR / 'attendance.db').as_posix()}"
+os.environ["OUTPUT_DIRECTORY"] = str(_TEST_DIR / "output")
+os.environ["RETENTION_DAYS"] = "0"
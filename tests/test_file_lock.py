@@ -0,0 +1,27 @@
+import os
+
+from attendance_app import file_lock
+from attendance_app.file_lock import atomic_write
+
+
+def test_atomic_write_retries_replace_while_target_is_open(tmp_path, monkeypatch):
+    target = tmp_path / "history.csv"
+    target.write_text("old", encoding="utf-8")
+
+    replace = os.replace
+    refusals = []
+
+    def busy_replace(source, destination):
+        # Windows refuses to rename over a file another process still has open
+        if len(refusals) < 2:
+            refusals.append(destination)
+            raise PermissionError(13, "The process cannot access the file")
+        replace(source, destination)
+
+    monkeypatch.setattr(file_lock.os, "replace", busy_replace)
+    with atomic_write(target, 'w', encoding="utf-8") as f:
+        f.write("new")
+
+    assert len(refusals) == 2
+    assert target.read_text(encoding="utf-8") == "new"
+    assert [path.name for path in tmp_path.iterdir()] == ["history.csv"]
@@ -0,0 +1,25 @@
+from datetime import date
+
+from attendance_app.history_partitions import HistoryPartitions
+from attendance_app.offline_storage import OfflineStorage
+
+
+def test_rebuild_removes_stale_partitions_and_their_caches(tmp_path):
+    storage = OfflineStorage(tmp_path / "attendance.db")
+    directory = tmp_path / "history"
+    today = date.today()
+    try:
+        storage.save_attendance_record("2025070019", "山田太郎", today.strftime("%Y/%m/%d 10:00:00"))
+        directory.mkdir()
+        (directory / "2020-01.csv").write_text("stale", encoding="utf-8")
+        (directory / "2020-01.csv.cache").mkdir()
+        (directory / "2020-01.csv.cache" / "meta.json").write_text("{}", encoding="utf-8")
+
+        partitions = HistoryPartitions(storage, directory, archive_directory=None)
+        current = f"{today:%Y-%m}.csv"
+        assert partitions.partition_path(today.year, today.month) == directory / current
+        assert partitions.partition_path(2020, 1) is None
+        assert sorted(path.name for path in directory.iterdir() if not path.name.endswith(".lock")) == [
+            current, "manifest.json"]
+    finally:
+        storage.close()
@@ -0,0 +1,143 @@
+import sqlite3
+
+from attendance_app.offline_storage import OfflineStorage
+
+
+def create_pre_revision_database(path):
+    """A database in the schema written before revisions and answer codes existed."""
+    conn = sqlite3.connect(str(path))
+    conn.executescript('''
+        CREATE TABLE attendance_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id TEXT NOT NULL,
+            student_name TEXT NOT NULL,
+            entry_time TEXT NOT NULL,
+            exit_time TEXT,
+            responses TEXT,
+            synced BOOLEAN DEFAULT FALSE,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+        CREATE TABLE sync_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            action TEXT NOT NULL,
+            status TEXT NOT NULL,
+            message TEXT,
+            record_count INTEGER
+        );
+    ''')
+    conn.executemany('''
+        INSERT INTO attendance_records (student_id, student_name, entry_time, exit_time, responses,
+                                        created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, 'x', 'x')
+    ''', [
+        ("2025070019", "山田太郎", "2026/09/01 10:00:00", "2026/09/01 15:00:00", '{"Mood": "晴れ"}'),
+        ("2025070028", "鈴木花子", "2026/09/02 11:00:00", None, None),
+    ])
+    conn.commit()
+    conn.close()
+
+
+def test_upgraded_database_exposes_existing_records(tmp_path):
+    db_path = tmp_path / "old.db"
+    create_pre_revision_database(db_path)
+
+    storage = OfflineStorage(db_path)
+    try:
+        rows = storage.get_history_rows()
+        assert [values for _, _, values in rows] == [
+            ["2026/09/01 10:00:00", "2025070019", "山田太郎", "晴れ", "", "", "2026/09/01 15:00:00"],
+            ["2026/09/02 11:00:00", "2025070028", "鈴木花子", "", "", "", ""],
+        ]
+        assert all(revision > 0 for _, revision, _ in rows)
+        assert storage.current_revision() == max(revision for _, revision, _ in rows)
+
+        # Later writes continue after the backfilled revisions
+        storage.save_attendance_record("2025070037", "佐藤次郎", "2026/09/03 09:00:00")
+        new_rows = storage.get_history_rows(max(revision for _, revision, _ in rows))
+        assert [values[1] for _, _, values in new_rows] == ["2025070037"]
+    finally:
+        storage.close()
+
+
+def test_reopening_an_upgraded_database_keeps_revisions(tmp_path):
+    db_path = tmp_path / "old.db"
+    create_pre_revision_database(db_path)
+    storage = OfflineStorage(db_path)
+    revisions = [revision for _, revision, _ in storage.get_history_rows()]
+    storage.close()
+
+    storage = OfflineStorage(db_path)
+    try:
+        assert [revision for _, revision, _ in storage.get_history_rows()] == revisions
+    finally:
+        storage.close()
+
+
+def test_answer_for_missing_record_adds_no_label(tmp_path):
+    storage = OfflineStorage(tmp_path / "attendance.db")
+    try:
+        revision = storage.current_revision()
+        assert storage.submit_record_field(999, "Mood", "x").result() is False
+
+        with storage.get_connection() as conn:
+            labels = [row['label'] for row in conn.execute('SELECT label FROM mood_labels')]
+        assert "x" not in labels
+        assert storage.current_revision() == revision
+    finally:
+        storage.close()
+
+
+def test_answer_is_stored_by_code(tmp_path):
+    storage = OfflineStorage(tmp_path / "attendance.db")
+    try:
+        record_id = storage.save_attendance_record("2025070019", "山田太郎", "2026/09/01 10:00:00")
+        assert storage.submit_record_field(record_id, "Mood", "晴れ").result() is True
+
+        (values,) = [values for _, _, values in storage.get_history_rows()]
+        assert values[3] == "晴れ"
+    finally:
+        storage.close()
+
+
+def test_open_session_lookup_uses_student_index(tmp_path):
+    storage = OfflineStorage(tmp_path / "attendance.db")
+    try:
+        with storage.get_connection() as conn:
+            plan = " ".join(row[3] for row in conn.execute('''
+                EXPLAIN QUERY PLAN
+                SELECT id, entry_time, exit_time FROM attendance_records
+                WHERE student_id = ?
+                ORDER BY entry_time DESC, id DESC LIMIT 1
+            ''', ("2025070019",)))
+        assert "idx_attendance_student_entry" in plan
+    finally:
+        storage.close()
+
+
+def test_legacy_history_is_migrated_once(tmp_path):
+    history = tmp_path / "attendance_history.csv"
+    history.write_text(
+        "Entry_Time,StudentID,Name,Mood,Sleep_Satisfaction,Purpose,Exit_Time\n"
+        "2026/09/01 10:00,2025070019,山田太郎,晴れ,75％,学ぶ,2026/09/01 15:00\n"
+        ",,,,,,\n"
+        "2026/09/02 11:00:00,2025070028,鈴木花子,,,,\n",
+        encoding="utf-8-sig",
+    )
+    storage = OfflineStorage(tmp_path / "attendance.db")
+    try:
+        assert storage.import_legacy_history(tmp_path / "missing.csv", history) == 2
+        assert [values for _, _, values in storage.get_history_rows()] == [
+            ["2026/09/01 10:00:00", "2025070019", "山田太郎", "晴れ", "75％", "学ぶ", "2026/09/01 15:00:00"],
+            ["2026/09/02 11:00:00", "2025070028", "鈴木花子", "", "", "", ""],
+        ]
+        assert sorted(path.name for path in tmp_path.iterdir() if "attendance_history" in path.name) == [
+            "attendance_history.csv"]
+
+        # An emptied database is not refilled
+        storage.cleanup_old_records(days=0, synced_only=False)
+        assert storage.count_records() == 0
+        assert storage.import_legacy_history(tmp_path / "missing.csv", history) == 0
+    finally:
+        storage.close()
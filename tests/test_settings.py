@@ -0,0 +1,14 @@
+from attendance_app.settings import SettingsManager
+
+
+def test_database_path_keeps_existing_offline_database(tmp_path):
+    manager = SettingsManager(tmp_path)
+    manager.settings.database_url = "sqlite:///attendance.db"
+
+    assert manager.get_database_path() == tmp_path / "attendance.db"
+
+    (tmp_path / "attendance_offline.db").touch()
+    assert manager.get_database_path() == tmp_path / "attendance_offline.db"
+
+    (tmp_path / "attendance.db").touch()
+    assert manager.get_database_path() == tmp_path / "attendance.db"
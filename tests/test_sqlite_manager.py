@@ -0,0 +1,30 @@
+import queue
+import threading
+
+import pytest
+
+from attendance_app.sqlite_manager import SQLiteConnectionManager
+
+
+def test_submit_to_full_queue_fails_without_blocking(tmp_path):
+    db = SQLiteConnectionManager(tmp_path / "test.db", queue_size=1)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_job(conn):
+        started.set()
+        release.wait(10)
+        return "slow"
+
+    first = db.submit(slow_job)
+    assert started.wait(10)
+    queued = db.submit(lambda conn: "queued")  # fills the queue while the writer is busy
+    rejected = db.submit(lambda conn: "rejected")
+
+    assert rejected.done()
+    with pytest.raises(queue.Full):
+        rejected.result()
+
+    release.set()
+    assert first.result(10) == "slow"
+    assert queued.result(10) == "queued"
+    db.close()
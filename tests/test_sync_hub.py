@@ -0,0 +1,85 @@
+import pytest
+
+from attendance_app.offline_storage import OfflineStorage
+from attendance_app.sync_hub import SyncHubClient, SyncHubError, SyncHubServer, SyncHubStore
+from attendance_app.sync_worker import HttpSyncTarget, SyncWorker
+
+TOKEN = "test-token"
+
+
+@pytest.fixture
+def hub(tmp_path):
+    server = SyncHubServer(SyncHubStore(tmp_path / "hub.db"), "127.0.0.1", 0, TOKEN)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def kiosks(tmp_path, hub):
+    """Two kiosk stores, each with a sync worker for the stand-in hub (run by hand, not on a thread)."""
+    workers = {}
+    for kiosk_id in ("A", "B"):
+        storage = OfflineStorage(tmp_path / f"kiosk_{kiosk_id}.db")
+        target = HttpSyncTarget(SyncHubClient(hub.url, kiosk_id, TOKEN))
+        workers[kiosk_id] = SyncWorker(target, storage, batch_size=2, interval=0, kiosk_id=kiosk_id)
+    yield workers
+    for worker in workers.values():
+        worker.stop()
+        worker.storage.close()
+
+
+def history(storage):
+    return sorted(values for _, _, values in storage.get_history_rows())
+
+
+def test_student_can_exit_at_another_kiosk(kiosks):
+    a, b = kiosks["A"], kiosks["B"]
+    a.storage.save_attendance_record("2025070019", "山田太郎", "2026/09/01 10:00:00", {"Mood": "晴れ"})
+    b.storage.save_attendance_record("2025070028", "鈴木花子", "2026/09/01 10:05:00")
+    a.storage.save_attendance_record("2025070037", "佐藤次郎", "2026/09/01 10:10:00")
+    for worker in (a, b, a):
+        worker.sync()
+
+    # Both kiosks see every record (pulled in batches of two)
+    assert history(a.storage) == history(b.storage)
+    assert len(history(b.storage)) == 3
+
+    # Entered at A, exits at B
+    record_id, _ = b.storage.get_open_session("2025070019")
+    assert b.storage.submit_record_field(record_id, "Exit_Time", "2026/09/01 15:00:00").result()
+    b.sync()
+    a.sync()
+
+    assert a.storage.get_open_session("2025070019") is None
+    assert history(a.storage) == history(b.storage)
+    assert ["2026/09/01 10:00:00", "2025070019", "山田太郎", "晴れ", "", "", "2026/09/01 15:00:00"] in history(
+        a.storage)
+
+    # The exit came back to A as a merge, not as a change of A's to upload
+    assert a.storage.get_unsynced_records() == []
+    assert b.storage.get_unsynced_records() == []
+
+
+def test_unsynced_local_change_is_kept_over_pulled_state(kiosks):
+    a, b = kiosks["A"], kiosks["B"]
+    a.storage.save_attendance_record("2025070019", "山田太郎", "2026/09/01 10:00:00")
+    a.sync()
+    b.sync()
+
+    record_id, _ = b.storage.get_open_session("2025070019")
+    assert b.storage.submit_record_field(record_id, "Exit_Time", "2026/09/01 15:00:00").result()
+    # A answers the question before it has seen the exit
+    assert a.storage.submit_record_field(1, "Mood", "雨").result()
+    a.pull()
+    assert [record['responses'] for record in a.storage.get_unsynced_records()] == [{"Mood": "雨"}]
+
+    for worker in (b, a, b):
+        worker.sync()
+    expected = ["2026/09/01 10:00:00", "2025070019", "山田太郎", "雨", "", "", "2026/09/01 15:00:00"]
+    assert history(a.storage) == history(b.storage) == [expected]
+
+
+def test_hub_rejects_pull_without_token(hub):
+    with pytest.raises(SyncHubError):
+        SyncHubClient(hub.url, "A").pull_records(0, 10)
@@ -0,0 +1,27 @@
+import pytest
+
+from attendance_app import sync_worker
+from attendance_app.offline_storage import offline_storage
+from attendance_app.sync_worker import ExcelSyncTarget, SyncTarget
+
+
+def test_sync_target_must_implement_upload():
+    class NoUpload(SyncTarget):
+        name = "none"
+
+    with pytest.raises(TypeError):
+        NoUpload()
+
+
+def test_excel_target_skips_workbook_that_is_up_to_date(monkeypatch):
+    calls = []
+    monkeypatch.setattr(sync_worker, "sync_attendance_to_excel", lambda: calls.append("sync") or True)
+    target = ExcelSyncTarget()
+
+    monkeypatch.setattr(sync_worker, "excel_synced_revision", lambda: offline_storage.current_revision())
+    target.upload([])
+    assert calls == []
+
+    monkeypatch.setattr(sync_worker, "excel_synced_revision", lambda: offline_storage.current_revision() - 1)
+    target.upload([])
+    assert calls == ["sync"]